@@ -3,12 +3,56 @@ import numpy as np
 import os
 from datetime import datetime, timedelta
 import io
+import hashlib
+import tempfile
+import zipfile
+import multiprocessing
+import time
+import json
+import pickle
 import warnings
-from openpyxl import Workbook
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from copy import copy
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import TIME_FORMATS
 from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.formatting.rule import FormulaRule
+from openpyxl.styles.differential import DifferentialStyle
+from openpyxl.utils import get_column_letter, range_boundaries
+from openpyxl.utils.indexed_list import IndexedList
 from openpyxl.utils.dataframe import dataframe_to_rows
+from openpyxl.reader.workbook import WorkbookParser
+from openpyxl.worksheet._reader import WorkSheetParser
+from openpyxl.xml.constants import ARC_WORKBOOK, SHEET_MAIN_NS
+from openpyxl.xml.functions import iterparse
+from openpyxl.cell.text import Text
+from pandas.io.parsers import TextParser
+from pandas.tseries.api import guess_datetime_format
 warnings.filterwarnings('ignore')
 
+# Leitura com calamine quando disponível (bem mais rápida que openpyxl)
+try:
+    import python_calamine  # noqa: F401
+    MOTOR_LEITURA_PADRAO = 'calamine'
+except ImportError:
+    MOTOR_LEITURA_PADRAO = None
+
+# Pico de memória do processo (indisponível no Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Cache em Parquet do DataFrame lido (requer pyarrow)
+try:
+    import pyarrow  # noqa: F401
+    CACHE_PARQUET_DISPONIVEL = True
+except ImportError:
+    CACHE_PARQUET_DISPONIVEL = False
+
 # Definir cores conforme solicitado
 CORES = {
     'cabecalho_fill': PatternFill(start_color='8F8D8D', end_color='8F8D8D', fill_type='solid'),
@@ -19,367 +63,2083 @@ CORES = {
     'in_stock': PatternFill(start_color='38F58A', end_color='38F58A', fill_type='solid'),
 }
 
-def criar_aba_overview(df):
-    """Cria a aba Overview com as análises solicitadas"""
+FONTE_PADRAO = Font(name='Aptos Narrow', size=11)
+FONTE_NEGRITO = Font(name='Aptos Narrow', size=11, bold=True)
+
+# Tipos de linha da Overview que recebem negrito: títulos e rótulos (primeira
+# coluna) e cabeçalhos de tabela (todas as colunas do cabeçalho)
+TIPOS_LINHA_OVERVIEW = ['titulos', 'cabecalhos', 'rotulos']
+
+# Motores de escrita do arquivo final
+MOTORES_SAIDA = ['streaming', 'paralelo', 'openpyxl']
+
+# Formatos do arquivo gerado: relatório formatado, .xlsx apenas com os dados (sem
+# estilos) e pacotes .zip com um arquivo Parquet ou CSV por aba, para consumo por
+# outros sistemas (Power BI, scripts)
+FORMATOS_SAIDA = ['xlsx', 'xlsx_simples', 'parquet', 'csv']
+SUFIXOS_FORMATOS_SAIDA = {
+    'xlsx': '.xlsx',
+    'xlsx_simples': ' (dados).xlsx',
+    'parquet': ' (parquet).zip',
+    'csv': ' (csv).zip',
+}
+
+# Quantidade de linhas convertidas por vez no motor em streaming
+TAMANHO_BLOCO_ESCRITA = 5000
+
+# Modo em blocos (memória limitada): linhas lidas por bloco e por lote na intercalação
+TAMANHO_BLOCO_LEITURA = 50000
+TAMANHO_LOTE_INTERCALACAO = 2000
+LARGURA_MAXIMA_COLUNA = 35
+
+# Regras de cor das linhas, na ordem de prioridade (coluna avaliada, classe)
+REGRAS_COR = [
+    ('Status', 'in_stock'),
+    ('DEMAND', 'demand_r'),
+    ('PROCUREMENT_KEY', 'procurement_e'),
+]
+CLASSES_LINHA = [None, 'in_stock', 'demand_r', 'procurement_e']
+
+# Mesmas regras como fórmulas de formatação condicional do Excel ({celula} = primeira linha
+# de dados da coluna avaliada); EXACT mantém a comparação sensível a maiúsculas, como no pandas
+FORMULAS_REGRAS_COR = {
+    'in_stock': 'EXACT({celula},"In Stock")',
+    'demand_r': 'EXACT(LEFT({celula},1),"R")',
+    'procurement_e': 'EXACT({celula},"E")',
+}
+
+# Como as cores são gravadas: preenchimento célula a célula ou regras de formatação
+# condicional do Excel, aplicadas uma vez por aba (arquivo menor; as cores acompanham
+# as edições feitas depois no Excel)
+FORMATACOES = ['celulas', 'condicional']
+
+# Lista de colunas de data para converter
+COLUNAS_DATA = [
+    "Data de necessidade", "Sup Date or Log Date", "OPENING_DATE", 
+    "Opening_Calculada", "PURCHASING_DOC_DATE", "DELIVERY_DATE", 
+    "SUPPLY_DATE", "REQUIRED_DATE", "Data_Atual"
+]
+
+# Formato de exibição das datas no Excel
+FORMATO_DATA_EXCEL = 'DD/MM/YYYY'
+
+# Colunas das abas RM, PO e Stock
+COLUNAS_RM = [
+    "RESPONSIBLE", "Escopo", "Equipment", "Prazo", "Status", "XP_STATUS",
+    "MATERIAL_NO", "MATERIAL_DESCRIPTION", "STATUS_STYPE", "PRREQRELSTAT",
+    "PO", "DOC PGR", "BUYER_NAME", "OPENING_DATE", "Float(Today-Opening)", "DELIVERY_DATE",
+    "SUPPLY_DATE", "REQUIRED_DATE", "FLOAT", "PLANNED_DELIVERY_TIME_MM",
+    "IN_HOUSE_PROD_TIME", "GRP_TIME_MM", "WBS", "EXCEPTION_MESSAGE", "Comentários SAP Planner"
+]
+COLUNAS_PO = [
+    "RESPONSIBLE", "Escopo", "Equipment", "Prazo", "Status", "XP_STATUS",
+    "MATERIAL_NO", "MATERIAL_DESCRIPTION", "STATUS_STYPE", "PO", "DOC PGR", "BUYER_NAME", 
+    "DELIVERY_DATE", "SUPPLY_DATE", "REQUIRED_DATE", "FLOAT", "VENDOR_NAME", "WBS", 
+    "EXCEPTION_MESSAGE", "Comentários SAP Planner", "Comentario LogPlan"
+]
+COLUNAS_STOCK = [
+    "RESPONSIBLE", "Equipment", "Prazo", "Status", "XP_STATUS",
+    "DEMAND", "MATERIAL_NO", "MATERIAL_DESCRIPTION", "STATUS_STYPE",
+    "PO", "REQUIRED_DATE", "WBS", "EXCEPTION_MESSAGE", "QN_NUMBER", 
+    "QN_COORDINATOR", "TYPE_310_", "TYPE_321_", "TYPE_999_", "ECN1", 
+    "ABRG_", "Comentários SAP Planner"
+]
+
+# Abas recortadas do Relatório BI: colunas e filtro (coluna, valores aceitos) de cada uma.
+# Novas abas entram aqui; as linhas são lidas do relatório por posição, sem cópias.
+ESPECIFICACOES_ABAS = [
+    {'nome': 'RM', 'colunas': COLUNAS_RM, 'filtro': ('STATUS_STYPE', ['PurRequist'])},
+    {'nome': 'PO', 'colunas': COLUNAS_PO, 'filtro': ('STATUS_STYPE', ['POConfirm', 'POCreated'])},
+    {'nome': 'Stock', 'colunas': COLUNAS_STOCK, 'filtro': ('Status', ['In Stock'])},
+]
+
+# Colunas usadas pela Overview, pelas regras de cor e pela ordenação
+COLUNAS_OVERVIEW = [
+    "Status", "STATUS_STYPE", "Equipment", "MATERIAL_NO", "MATERIAL_DESCRIPTION",
+    "Float(Today-Opening)", "PROCUREMENT_KEY", "OPENING_DATE"
+]
+COLUNAS_CONTROLE = ["Counter", "DEMAND", "PROCUREMENT_KEY", "Status"]
+
+# Colunas exigidas por cada seção da Overview (sem elas a seção sai como "NÃO ENCONTRADAS")
+SECOES_OVERVIEW = {
+    'Estatísticas rápidas': ["Status", "STATUS_STYPE"],
+    'Contagem cruzada': ["STATUS_STYPE", "Equipment"],
+    'Itens com atraso': ["MATERIAL_NO", "MATERIAL_DESCRIPTION", "Float(Today-Opening)"],
+    'Itens de montagem': ["PROCUREMENT_KEY", "MATERIAL_NO", "MATERIAL_DESCRIPTION", "OPENING_DATE"],
+}
+
+# União de todas as colunas lidas quando o Relatório BI completo não é necessário
+COLUNAS_UTILIZADAS = list(dict.fromkeys(
+    COLUNAS_CONTROLE + COLUNAS_OVERVIEW + COLUNAS_RM + COLUNAS_PO + COLUNAS_STOCK + COLUNAS_DATA
+))
+
+# Colunas de baixa cardinalidade lidas como categóricas
+COLUNAS_CATEGORICAS = ["STATUS_STYPE", "Status", "PROCUREMENT_KEY", "Equipment"]
+
+# Relatório de alterações: chave das linhas entre um processamento e o seguinte
+COLUNAS_CHAVE_INCREMENTAL = ["Counter", "MATERIAL_NO"]
+ABA_ALTERACOES = 'Alterações'
+COLUNAS_ALTERACOES = [
+    "Counter", "MATERIAL_NO", "MATERIAL_DESCRIPTION", "STATUS_STYPE", "Status",
+    "DEMAND", "PROCUREMENT_KEY"
+]
+
+# Versão das regras de processamento (incrementar ao mudar abas, cores ou Overview)
+VERSAO_REGRAS = 2
+
+# Cache local dos arquivos já lidos (incrementar a versão ao mudar a leitura)
+VERSAO_LEITURA = 1
+DIRETORIO_CACHE = os.environ.get(
+    'PLAN_APP_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'plan_app_cache')
+)
+
+# Limites de disco de cada subdiretório do cache (leitura e incremental): arquivos sem uso
+# há mais que a validade são apagados e, acima do tamanho máximo, os menos usados primeiro
+MAX_MB_CACHE_DISCO = int(os.environ.get('PLAN_APP_CACHE_DISCO_MAX_MB', '2048'))
+TTL_CACHE_DISCO_SEGUNDOS = int(os.environ.get('PLAN_APP_CACHE_DISCO_TTL_SEGUNDOS', str(30 * 24 * 60 * 60)))
+
+# Log de desempenho (uma linha JSON por processamento)
+ARQUIVO_LOG_DESEMPENHO = os.environ.get(
+    'PLAN_APP_LOG_DESEMPENHO', os.path.join(DIRETORIO_CACHE, 'desempenho.jsonl')
+)
+
+# Impressões digitais de cabeçalhos já validados (validação instantânea para formatos repetidos)
+ARQUIVO_ESQUEMAS_CONHECIDOS = os.path.join(DIRETORIO_CACHE, 'esquemas_conhecidos.json')
+
+# Estimativa de custo do processamento por milhão de células (medido com benchmark.py)
+SEGUNDOS_POR_MILHAO_CELULAS = 50
+MB_POR_MILHAO_CELULAS = 80
+MEMORIA_BASE_MB = 80
+
+# Bytes iniciais do XML da aba usados para estimar as linhas quando não há <dimension>
+AMOSTRA_LINHAS_BYTES = 256 * 1024
+
+# Ferramentas de captura detalhada aceitas pelo perfil
+CAPTURAS_PERFIL = ['cprofile', 'pyinstrument']
+
+def memoria_atual_mb():
+    """Memória residente atual do processo em MB (None fora do Linux)"""
+    try:
+        with open('/proc/self/statm') as f:
+            paginas = int(f.read().split()[1])
+        return paginas * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def reiniciar_pico_memoria():
+    """Zera o pico de memória residente do processo (Linux); False se não for possível"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def pico_memoria_mb():
+    """Pico de memória residente do processo em MB (None se indisponível)
+    
+    No Linux é o pico desde o último reiniciar_pico_memoria(); nos demais
+    sistemas, o pico desde o início do processo.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for linha in f:
+                if linha.startswith('VmHWM:'):
+                    return int(linha.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB, macOS em bytes
+    return pico / (1024 * 1024) if os.uname().sysname == 'Darwin' else pico / 1024
+
+class PerfilProcessamento:
+    """Tempo, volume (linhas/células) e memória de cada etapa do processamento
+    
+    Cada etapa é registrada com `with perfil.etapa(nome) as info:`; o
+    dicionário `info` pode receber `linhas` e `celulas` durante a etapa.
+    Opcionalmente captura o processamento inteiro com cProfile ou pyinstrument.
+    
+    Os picos de memória são deste processamento: o pico do processo é zerado
+    em `iniciar()` (Linux) ou, se não der, é o maior valor medido entre as
+    etapas. Sem nenhuma das duas medidas, vale o pico desde o início do
+    processo e `escopo_pico_memoria` passa a ser 'processo'.
+    """
+    
+    def __init__(self, captura=None):
+        if captura is not None and captura not in CAPTURAS_PERFIL:
+            raise ValueError(f"Captura de perfil desconhecida: {captura}")
+        self.captura = captura
+        self.etapas = []
+        self.etapa_atual = None
+        self.texto_captura = None
+        self.criado_em = datetime.now().isoformat(timespec='seconds')
+        self.total_segundos = None
+        self.incremental = None
+        self.memoria_inicial_mb = None
+        self.escopo_pico_memoria = 'processo'
+        self._pico_amostrado_mb = None
+        self._inicio = None
+        self._profiler = None
+    
+    def iniciar(self):
+        """Marca o início do processamento e liga a captura, se houver"""
+        self._inicio = time.perf_counter()
+        self.memoria_inicial_mb = self._pico_amostrado_mb = memoria_atual_mb()
+        if reiniciar_pico_memoria():
+            self.escopo_pico_memoria = 'execucao'
+        elif self.memoria_inicial_mb is not None:
+            self.escopo_pico_memoria = 'amostras'
+        if self.captura == 'cprofile':
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self.captura == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                self.texto_captura = "pyinstrument não está instalado"
+                return
+            self._profiler = Profiler()
+            self._profiler.start()
+    
+    def finalizar(self):
+        """Encerra a medição total e gera o texto da captura"""
+        if self._inicio is not None:
+            self.total_segundos = time.perf_counter() - self._inicio
+        if self._profiler is None:
+            return
+        
+        if self.captura == 'cprofile':
+            import pstats
+            self._profiler.disable()
+            saida = io.StringIO()
+            pstats.Stats(self._profiler, stream=saida).sort_stats('cumulative').print_stats(40)
+            self.texto_captura = saida.getvalue()
+        else:
+            self._profiler.stop()
+            self.texto_captura = self._profiler.output_text()
+        self._profiler = None
+    
+    @contextmanager
+    def etapa(self, nome, linhas=None, celulas=None):
+        """Cronometra uma etapa; em caso de erro, `etapa_atual` continua apontando para ela"""
+        self.etapa_atual = nome
+        info = {'linhas': linhas, 'celulas': celulas}
+        self._amostrar_memoria()
+        inicio = time.perf_counter()
+        yield info
+        self.registrar(nome, time.perf_counter() - inicio, info['linhas'], info['celulas'])
+        self.etapa_atual = None
+    
+    def _amostrar_memoria(self):
+        """Memória atual, acumulando o maior valor medido neste processamento"""
+        memoria = memoria_atual_mb()
+        if memoria is not None:
+            self._pico_amostrado_mb = max(memoria, self._pico_amostrado_mb or 0)
+        return memoria
+    
+    def pico_memoria_mb(self):
+        """Pico de memória deste processamento até agora (ver `escopo_pico_memoria`)"""
+        if self.escopo_pico_memoria == 'amostras':
+            return self._pico_amostrado_mb
+        return pico_memoria_mb()
+    
+    def registrar(self, nome, segundos, linhas=None, celulas=None):
+        """Registra uma etapa já medida (por exemplo, em outro processo)"""
+        self.etapas.append({
+            'etapa': nome,
+            'segundos': segundos,
+            'linhas': linhas,
+            'celulas': celulas,
+            'memoria_mb': self._amostrar_memoria(),
+            'pico_memoria_mb': self.pico_memoria_mb(),
+        })
+    
+    def como_dict(self):
+        """Representação serializável (JSON) do perfil"""
+        return {
+            'criado_em': self.criado_em,
+            'total_segundos': self.total_segundos,
+            'memoria_inicial_mb': self.memoria_inicial_mb,
+            'pico_memoria_mb': self.pico_memoria_mb(),
+            'escopo_pico_memoria': self.escopo_pico_memoria,
+            'etapas': self.etapas,
+            'incremental': self.incremental,
+            'captura': self.captura,
+            'texto_captura': self.texto_captura,
+        }
+
+def _etapa(perfil, nome, linhas=None, celulas=None):
+    """Contexto de medição da etapa no perfil (sem efeito quando não há perfil)"""
+    if perfil is None:
+        return nullcontext({'linhas': linhas, 'celulas': celulas})
+    return perfil.etapa(nome, linhas, celulas)
+
+def registrar_perfil_json(perfil, caminho=ARQUIVO_LOG_DESEMPENHO, **extras):
+    """Acrescenta o perfil (dict) como uma linha JSON no log de desempenho"""
+    registro = dict(perfil, **extras)
+    pasta = os.path.dirname(caminho)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    with open(caminho, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(registro, ensure_ascii=False, default=str) + '\n')
+
+def ler_conteudo_arquivo(arquivo):
+    """Retorna os bytes do arquivo enviado (UploadedFile, caminho ou objeto de arquivo)"""
+    if isinstance(arquivo, (bytes, bytearray)):
+        return bytes(arquivo)
+    if isinstance(arquivo, (str, os.PathLike)):
+        with open(arquivo, 'rb') as f:
+            return f.read()
+    if hasattr(arquivo, 'getvalue'):
+        return arquivo.getvalue()
+    
+    arquivo.seek(0)
+    conteudo = arquivo.read()
+    arquivo.seek(0)
+    return conteudo
+
+def calcular_hash_conteudo(conteudo):
+    """Hash SHA-256 do conteúdo do arquivo"""
+    return hashlib.sha256(conteudo).hexdigest()
+
+def _caminho_cache_leitura(hash_conteudo, colunas, motor_leitura=MOTOR_LEITURA_PADRAO):
+    """Caminho do Parquet em cache para o conteúdo, a seleção de colunas e o motor de leitura
+    
+    Os motores não inferem os tipos das células exatamente da mesma forma, por
+    isso cada um tem a sua entrada.
+    """
+    chave = f"v{VERSAO_LEITURA}-{motor_leitura or 'openpyxl'}-{hash_conteudo}"
+    if colunas is not None:
+        chave += '-' + hashlib.sha256('|'.join(colunas).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(DIRETORIO_CACHE, 'leitura', f"{chave}.parquet")
+
+def _marcar_uso_cache(caminho):
+    """Atualiza a data de modificação do arquivo, que define a ordem de descarte do cache"""
+    try:
+        os.utime(caminho)
+    except OSError:
+        pass
+
+def _limpar_cache_disco(diretorio, manter=None):
+    """Apaga arquivos vencidos do diretório e os menos usados além do tamanho máximo
+    
+    O uso de cada arquivo é a data de modificação (gravação ou último acerto);
+    `manter` (o arquivo recém-gravado) nunca é apagado. Arquivos temporários de
+    gravações em andamento só são apagados depois de vencidos.
+    """
+    agora = time.time()
+    arquivos = []
+    try:
+        entradas = list(os.scandir(diretorio))
+    except OSError:
+        return
+    for entrada in entradas:
+        try:
+            info = entrada.stat()
+        except OSError:
+            continue
+        if not entrada.is_file() or entrada.path == manter:
+            continue
+        if agora - info.st_mtime > TTL_CACHE_DISCO_SEGUNDOS:
+            try:
+                os.remove(entrada.path)
+            except OSError:
+                pass
+        elif not entrada.name.endswith('.tmp'):
+            arquivos.append((info.st_mtime, info.st_size, entrada.path))
+    
+    total = sum(tamanho for _, tamanho, _ in arquivos)
+    if manter is not None and os.path.exists(manter):
+        total += os.path.getsize(manter)
+    for _, tamanho, caminho in sorted(arquivos):
+        if total <= MAX_MB_CACHE_DISCO * 1024 * 1024:
+            break
+        try:
+            os.remove(caminho)
+            total -= tamanho
+        except OSError:
+            pass
+
+def aplicar_tipos_leitura(df):
+    """Converte as colunas de baixa cardinalidade para categóricas"""
+    for col in COLUNAS_CATEGORICAS:
+        if col in df.columns:
+            try:
+                df[col] = df[col].astype('category')
+            except (TypeError, ValueError):
+                pass
+    return df
+
+def ler_relatorio(arquivo, colunas=None, motor_leitura=MOTOR_LEITURA_PADRAO, usar_cache=True,
+                  perfil=None):
+    """Carrega o relatório do BI
+    
+    Lê apenas `colunas` (quando informado), usa calamine se estiver instalado,
+    aplica tipos categóricos e guarda o resultado em Parquet, indexado pelo
+    hash do conteúdo, para que o mesmo arquivo não precise ser lido de novo.
+    """
+    conteudo = ler_conteudo_arquivo(arquivo)
+    
+    caminho_cache = None
+    if usar_cache and CACHE_PARQUET_DISPONIVEL:
+        caminho_cache = _caminho_cache_leitura(calcular_hash_conteudo(conteudo), colunas, motor_leitura)
+        if os.path.exists(caminho_cache):
+            try:
+                with _etapa(perfil, 'leitura (cache parquet)') as info:
+                    df = pd.read_parquet(caminho_cache)
+                    info['linhas'], info['celulas'] = len(df), df.size
+                _marcar_uso_cache(caminho_cache)
+                return df
+            except Exception:
+                pass
+    
+    usecols = None
+    if colunas is not None:
+        selecionadas = set(colunas)
+        usecols = lambda col: col in selecionadas
+    
+    with _etapa(perfil, 'leitura (read_excel)') as info:
+        df = pd.read_excel(io.BytesIO(conteudo), engine=motor_leitura, usecols=usecols)
+        info['linhas'], info['celulas'] = len(df), df.size
+    
+    with _etapa(perfil, 'tipos categóricos'):
+        df = aplicar_tipos_leitura(df)
+    
+    if caminho_cache is not None:
+        # Colunas com tipos mistos não são aceitas pelo Parquet; nesse caso apenas não há cache
+        try:
+            os.makedirs(os.path.dirname(caminho_cache), exist_ok=True)
+            temporario = f"{caminho_cache}.{os.getpid()}.tmp"
+            df.to_parquet(temporario)
+            os.replace(temporario, caminho_cache)
+        except Exception:
+            pass
+        _limpar_cache_disco(os.path.dirname(caminho_cache), manter=caminho_cache)
+    
+    return df
+
+class _TextosCompartilhados:
+    """Tabela de textos compartilhados do .xlsx lida só até o maior índice consultado
+    
+    O cabeçalho costuma usar os primeiros textos da tabela, então a validação
+    não precisa carregar os textos de todas as células do relatório.
+    """
+    
+    def __init__(self, pacote):
+        self.textos = []
+        self._elementos = None
+        if 'xl/sharedStrings.xml' in pacote.namelist():
+            self._elementos = iterparse(pacote.open('xl/sharedStrings.xml'))
+    
+    def __getitem__(self, indice):
+        marcador = f'{{{SHEET_MAIN_NS}}}si'
+        while len(self.textos) <= indice and self._elementos is not None:
+            _, elemento = next(self._elementos, (None, None))
+            if elemento is None:
+                self._elementos = None
+            elif elemento.tag == marcador:
+                self.textos.append(Text.from_tree(elemento).content)
+                elemento.clear()
+        return self.textos[indice]
+
+def _linhas_aba(pacote, caminho):
+    """Número de linhas de dados da aba pela tag <dimension> ou, sem ela, estimado pelo tamanho do XML
+    
+    Retorna (linhas, estimado).
+    """
+    marcadores = {f'{{{SHEET_MAIN_NS}}}dimension', f'{{{SHEET_MAIN_NS}}}sheetData'}
+    for _, elemento in iterparse(pacote.open(caminho), events=('start',)):
+        if elemento.tag not in marcadores:
+            continue
+        if elemento.tag.endswith('dimension') and elemento.get('ref'):
+            max_row = range_boundaries(elemento.get('ref'))[3]
+            if max_row is not None:
+                return max(max_row - 1, 0), False
+        break
+    
+    # Tamanho médio das primeiras linhas aplicado ao XML inteiro
+    tamanho_total = pacote.getinfo(caminho).file_size
+    with pacote.open(caminho) as f:
+        amostra = f.read(AMOSTRA_LINHAS_BYTES)
+    inicio = amostra.find(b'<row')
+    fim = amostra.rfind(b'</row>')
+    linhas_amostra = amostra.count(b'</row>')
+    if inicio < 0 or fim < 0 or not linhas_amostra:
+        return 0, len(amostra) >= tamanho_total
+    if len(amostra) >= tamanho_total:
+        return linhas_amostra - 1, False
+    bytes_por_linha = (fim - inicio) / linhas_amostra
+    return max(int((tamanho_total - inicio) / bytes_por_linha) - 1, 0), True
+
+def ler_esquema_relatorio(arquivo):
+    """Lê apenas o cabeçalho e as dimensões da primeira aba do relatório
+    
+    No .xlsx, o XML da aba é percorrido só até a primeira linha e a tabela de
+    textos só até os textos do cabeçalho. `linhas` (de dados) vem das
+    dimensões da aba ou, se o arquivo não as informar, é estimado pelo tamanho
+    do XML (`linhas_estimadas`); é None quando o arquivo não é um .xlsx.
+    """
+    conteudo = ler_conteudo_arquivo(arquivo)
+    buffer = io.BytesIO(conteudo)
+    if not zipfile.is_zipfile(buffer):
+        colunas = pd.read_excel(buffer, nrows=0).columns
+        return {'colunas': [str(col) for col in colunas], 'linhas': None, 'linhas_estimadas': False}
+    
+    with zipfile.ZipFile(buffer) as pacote:
+        parser_workbook = WorkbookParser(pacote, ARC_WORKBOOK)
+        parser_workbook.parse()
+        _, relacao = next(parser_workbook.find_sheets())
+        caminho = relacao.target.lstrip('/')
+        
+        linhas, linhas_estimadas = _linhas_aba(pacote, caminho)
+        parser = WorkSheetParser(pacote.open(caminho), _TextosCompartilhados(pacote), data_only=True)
+        _, celulas = next(parser.parse(), (None, []))
+    
+    # Colunas sem nome no fim do cabeçalho são descartadas, como no read_excel
+    valores = {celula['column']: celula['value'] for celula in celulas}
+    total_colunas = max((coluna for coluna, valor in valores.items() if valor is not None), default=0)
+    colunas = [str(valores[idx]) if valores.get(idx) is not None else f"Unnamed: {idx - 1}"
+               for idx in range(1, total_colunas + 1)]
+    return {'colunas': colunas, 'linhas': linhas, 'linhas_estimadas': linhas_estimadas}
+
+def impressao_esquema(colunas):
+    """Impressão digital do cabeçalho (nomes e ordem das colunas) nas regras atuais"""
+    texto = '\x1f'.join([f"v{VERSAO_REGRAS}"] + list(colunas))
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+def carregar_esquemas_conhecidos(caminho=ARQUIVO_ESQUEMAS_CONHECIDOS):
+    """Impressões dos cabeçalhos já validados sem erros"""
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _registrar_esquema_conhecido(impressao, colunas, avisos, caminho=ARQUIVO_ESQUEMAS_CONHECIDOS):
+    """Guarda a impressão de um cabeçalho válido com seus avisos (falhas de gravação são ignoradas)"""
+    esquemas = carregar_esquemas_conhecidos(caminho)
+    esquemas[impressao] = {
+        'colunas': len(colunas),
+        'avisos': avisos,
+        'validado_em': datetime.now().isoformat(timespec='seconds'),
+    }
+    try:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(esquemas, f, indent=2)
+        os.replace(temporario, caminho)
+    except OSError:
+        pass
+
+def validar_esquema(colunas, caminho_conhecidos=ARQUIVO_ESQUEMAS_CONHECIDOS):
+    """Confere o cabeçalho com as colunas exigidas por cada aba e seção da Overview
+    
+    Erros (filtro de uma aba ou seção da Overview sem suas colunas) indicam que
+    provavelmente não é o relatório esperado; colunas de exibição ausentes nas
+    abas são apenas avisos. Cabeçalhos válidos são lembrados pela impressão
+    digital, junto com os avisos, e da próxima vez são aceitos sem conferência.
+    """
+    impressao = impressao_esquema(colunas)
+    conhecido = carregar_esquemas_conhecidos(caminho_conhecidos).get(impressao)
+    # Registros sem os avisos (gravados antes de eles serem guardados) são conferidos de novo
+    if conhecido is not None and 'avisos' in conhecido:
+        return {'impressao': impressao, 'conhecido': True, 'erros': [], 'avisos': conhecido['avisos'],
+                'valido': True}
+    
+    presentes = set(colunas)
+    erros = []
+    avisos = []
+    for especificacao in ESPECIFICACOES_ABAS:
+        coluna_filtro = especificacao['filtro'][0]
+        if coluna_filtro not in presentes:
+            erros.append(f"Aba {especificacao['nome']}: coluna de filtro {coluna_filtro} não encontrada "
+                         "(a aba sairá vazia)")
+        faltantes = [col for col in especificacao['colunas'] if col not in presentes]
+        if faltantes:
+            avisos.append(f"Aba {especificacao['nome']}: colunas não encontradas: {', '.join(faltantes)}")
+    for secao, exigidas in SECOES_OVERVIEW.items():
+        faltantes = [col for col in exigidas if col not in presentes]
+        if faltantes:
+            erros.append(f"Overview - {secao}: colunas não encontradas: {', '.join(faltantes)}")
+    
+    if not erros:
+        _registrar_esquema_conhecido(impressao, colunas, avisos, caminho_conhecidos)
+    return {'impressao': impressao, 'conhecido': False, 'erros': erros, 'avisos': avisos,
+            'valido': not erros}
+
+def estimar_processamento(linhas, colunas, tamanho_bloco_leitura=None):
+    """Tempo (s) e memória (MB) estimados para processar o relatório, pelo número de células
+    
+    No processamento em blocos a memória é limitada pelo tamanho do bloco.
+    Retorna None quando o número de linhas é desconhecido.
+    """
+    if linhas is None:
+        return None
+    milhoes_celulas = linhas * colunas / 1e6
+    milhoes_celulas_memoria = milhoes_celulas
+    if tamanho_bloco_leitura is not None:
+        milhoes_celulas_memoria = min(linhas, tamanho_bloco_leitura) * colunas / 1e6
+    return {
+        'segundos': milhoes_celulas * SEGUNDOS_POR_MILHAO_CELULAS,
+        'memoria_mb': MEMORIA_BASE_MB + milhoes_celulas_memoria * MB_POR_MILHAO_CELULAS,
+    }
+
+def converter_coluna_data(serie, nome=None, formatos=None):
+    """Converte uma coluna para datetime64 (apenas a data, sem horário)
+    
+    Colunas lidas do Excel normalmente já vêm como datetime64. Para colunas de
+    texto, o formato é inferido do primeiro valor com dia antes do mês
+    (03/04/2024 é 3 de abril), como nos exports do BI. `formatos` (dict por
+    nome de coluna) guarda o formato inferido para as conversões seguintes do
+    mesmo arquivo, como os blocos do processamento em blocos; se deixar de
+    servir, é inferido de novo.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.dt.normalize()
+    
+    if formatos is None:
+        formatos = {}
+    formato = formatos.get(nome)
+    if formato is not None:
+        convertida = pd.to_datetime(serie, format=formato, errors='coerce')
+        if convertida.notna().sum() == serie.notna().sum():
+            return convertida.dt.normalize()
+    
+    amostra = serie.dropna()
+    amostra = amostra[amostra.map(lambda valor: isinstance(valor, str))].head(1)
+    formato = None
+    if len(amostra):
+        # Valores que só fazem sentido com o mês antes do dia (04/25/2024) são aceitos sem aviso
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            formato = guess_datetime_format(amostra.iloc[0], dayfirst=True)
+    if formato is not None and nome is not None:
+        formatos[nome] = formato
+    
+    convertida = pd.to_datetime(serie, format=formato, errors='coerce')
+    return convertida.dt.normalize()
+
+def _bloco_overview(*colunas):
+    """Monta um bloco da Overview a partir de colunas (posição 0, 1, 2...)"""
+    return pd.DataFrame({posicao: np.asarray(coluna, dtype=object) for posicao, coluna in enumerate(colunas)})
+
+def calcular_agregados_overview(df, hoje=None):
+    """Calcula as agregações da Overview (contagens, contagem cruzada, atrasos e montagens)
+    
+    Os agregados de partes do relatório podem ser somados com
+    combinar_agregados_overview, o que permite montar a Overview por blocos.
+    """
+    hoje = hoje or datetime.now()
+    colunas = df.columns
+    
+    # Uma única contagem por coluna em vez de um filtro por status
+    agregados = {
+        'total_linhas': len(df),
+        'contagem_status': df['Status'].value_counts() if 'Status' in colunas else pd.Series(dtype=int),
+        'contagem_stype': df['STATUS_STYPE'].value_counts() if 'STATUS_STYPE' in colunas else pd.Series(dtype=int),
+        'cruzada': None,
+        'atraso': None,
+        'total_montagem': None,
+        'montagem': None,
+    }
+    
+    # Contagem de cada par (Equipment, STATUS_STYPE); a tabela cruzada é montada no final
+    if 'STATUS_STYPE' in colunas and 'Equipment' in colunas:
+        agregados['cruzada'] = df.groupby(['Equipment', 'STATUS_STYPE'], observed=True).size()
+    
+    if all(col in colunas for col in ['MATERIAL_NO', 'MATERIAL_DESCRIPTION', 'Float(Today-Opening)']):
+        # Converter apenas a coluna Float(Today-Opening), sem copiar o DataFrame
+        atraso = pd.to_numeric(df['Float(Today-Opening)'], errors='coerce').reset_index(drop=True)
+        
+        # Posições dos 15 menores valores (incluindo negativos); NaN é ignorado
+        posicoes = atraso.nsmallest(15).index.to_numpy()
+        agregados['atraso'] = _bloco_overview(
+            df['MATERIAL_NO'].iloc[posicoes],
+            df['MATERIAL_DESCRIPTION'].iloc[posicoes],
+            atraso.iloc[posicoes]
+        )
+    
+    if all(col in colunas for col in ['PROCUREMENT_KEY', 'MATERIAL_NO', 'MATERIAL_DESCRIPTION', 'OPENING_DATE']):
+        montagem = (df['PROCUREMENT_KEY'] == 'E').to_numpy(dtype=bool, na_value=False)
+        agregados['total_montagem'] = int(montagem.sum())
+        
+        # OPENING_DATE já vem como datetime64 de processar_arquivo
+        datas = converter_coluna_data(df['OPENING_DATE'][montagem], 'OPENING_DATE')
+        
+        # Filtrar para próximos 3 meses
+        tres_meses = hoje + timedelta(days=90)
+        datas = datas[(datas >= hoje) & (datas <= tres_meses)]
+        agregados['montagem'] = _bloco_overview(
+            df['MATERIAL_NO'].loc[datas.index],
+            df['MATERIAL_DESCRIPTION'].loc[datas.index],
+            datas
+        )
+    
+    return agregados
+
+def combinar_agregados_overview(acumulado, novo):
+    """Soma os agregados de duas partes consecutivas do relatório"""
+    if acumulado is None:
+        return novo
+    
+    def somar(a, b):
+        return b if a is None else a.add(b, fill_value=0).astype(int)
+    
+    def concatenar(a, b):
+        return b if a is None else pd.concat([a, b], ignore_index=True)
+    
+    combinado = {
+        'total_linhas': acumulado['total_linhas'] + novo['total_linhas'],
+        'contagem_status': somar(acumulado['contagem_status'], novo['contagem_status']),
+        'contagem_stype': somar(acumulado['contagem_stype'], novo['contagem_stype']),
+        'cruzada': somar(acumulado['cruzada'], novo['cruzada']),
+        'atraso': concatenar(acumulado['atraso'], novo['atraso']),
+        'total_montagem': None,
+        'montagem': concatenar(acumulado['montagem'], novo['montagem']),
+    }
+    if novo['total_montagem'] is not None:
+        combinado['total_montagem'] = (acumulado['total_montagem'] or 0) + novo['total_montagem']
+    
+    # Apenas os 15 maiores atrasos precisam ser mantidos (na ordem em que aparecem)
+    if combinado['atraso'] is not None:
+        atraso = pd.to_numeric(combinado['atraso'][2])
+        combinado['atraso'] = combinado['atraso'].loc[atraso.nsmallest(15).index].reset_index(drop=True)
+    
+    return combinado
+
+def _ordenar_rotulos(tabela, eixo):
+    """Ordena linhas ou colunas pelos rótulos; rótulos que não se comparam (números e textos) pelo texto"""
+    try:
+        return tabela.sort_index(axis=eixo)
+    except TypeError:
+        return tabela.sort_index(axis=eixo, key=lambda rotulos: rotulos.map(str))
+
+def _tabela_cruzada(contagem):
+    """Tabela Equipment x STATUS_STYPE com totais, a partir da contagem de cada par"""
+    tabela = contagem.unstack(fill_value=0).astype(int)
+    tabela.index = pd.Index(list(tabela.index), dtype=object)
+    tabela.columns = pd.Index(list(tabela.columns), dtype=object)
+    tabela = _ordenar_rotulos(_ordenar_rotulos(tabela, 0), 1)
+    tabela['TOTAL'] = tabela.sum(axis=1)
+    tabela.loc['TOTAL'] = tabela.sum(axis=0)
+    return tabela
+
+def criar_aba_overview(df=None, agregados=None):
+    """Cria a aba Overview com as análises solicitadas
+    
+    Recebe o relatório completo ou os agregados já calculados (modo em blocos).
+    As linhas de títulos, cabeçalhos e rótulos ficam registradas em
+    `df_overview.attrs['layout']` (tipo -> lista de (linha, quantidade de colunas)),
+    usadas pelos escritores para aplicar o negrito sem procurar textos nas células.
+    """
+    if agregados is None:
+        agregados = calcular_agregados_overview(df)
     
-    # Criar um DataFrame vazio para a Overview
+    # A Overview é montada como uma sequência de blocos (linhas de texto ou tabelas)
+    blocos = []
     overview_data = []
+    linhas_blocos = 0
+    layout = {tipo: [] for tipo in TIPOS_LINHA_OVERVIEW}
+    
+    def fechar_linhas():
+        if overview_data:
+            adicionar_bloco(pd.DataFrame(overview_data))
+            overview_data.clear()
+    
+    def adicionar_bloco(bloco):
+        nonlocal linhas_blocos
+        blocos.append(bloco)
+        linhas_blocos += len(bloco)
+    
+    def adicionar_linha(valores, tipo=None):
+        if tipo is not None:
+            colunas = len(valores) if tipo == 'cabecalhos' else 1
+            layout[tipo].append((linhas_blocos + len(overview_data), colunas))
+        overview_data.append(valores)
     
     # Título principal
-    overview_data.append(["RELATÓRIO DE PLANEJAMENTO - VISÃO GERAL"])
-    overview_data.append([])  # Linha em branco
+    adicionar_linha(["RELATÓRIO DE PLANEJAMENTO - VISÃO GERAL"], 'titulos')
+    adicionar_linha([])  # Linha em branco
     
     # Adicionar data de geração do relatório
     data_geracao = datetime.now().strftime("%d/%m/%Y %H:%M")
-    overview_data.append([f"Relatório gerado em: {data_geracao}"])
-    overview_data.append([])  # Linha em branco
+    adicionar_linha([f"Relatório gerado em: {data_geracao}"], 'titulos')
+    adicionar_linha([])  # Linha em branco
     
     # Estatísticas rápidas
-    overview_data.append(["ESTATÍSTICAS RÁPIDAS"])
-    overview_data.append([])
+    adicionar_linha(["ESTATÍSTICAS RÁPIDAS"], 'titulos')
+    adicionar_linha([])
     
-    total_linhas = len(df)
-    if 'Status' in df.columns:
-        in_stock_count = len(df[df['Status'] == 'In Stock'])
-    else:
-        in_stock_count = 0
-        
-    if 'STATUS_STYPE' in df.columns:
-        purrequist_count = len(df[df['STATUS_STYPE'] == 'PurRequist'])
-        poconfirm_count = len(df[df['STATUS_STYPE'] == 'POConfirm'])
-        pocreated_count = len(df[df['STATUS_STYPE'] == 'POCreated'])
-    else:
-        purrequist_count = poconfirm_count = pocreated_count = 0
+    contagem_status = agregados['contagem_status']
+    contagem_stype = agregados['contagem_stype']
+    in_stock_count = int(contagem_status.get('In Stock', 0))
+    purrequist_count = int(contagem_stype.get('PurRequist', 0))
+    poconfirm_count = int(contagem_stype.get('POConfirm', 0))
+    pocreated_count = int(contagem_stype.get('POCreated', 0))
     
-    overview_data.append(["TOTAL DE ITENS NO RELATÓRIO:", total_linhas])
-    overview_data.append(["ITENS EM ESTOQUE (IN STOCK):", in_stock_count])
-    overview_data.append(["REQUISIÇÕES DE COMPRA (PURREQUIST):", purrequist_count])
-    overview_data.append(["ORDENS CONFIRMADAS (POCONFIRM):", poconfirm_count])
-    overview_data.append(["ORDENS CRIADAS (POCREATED):", pocreated_count])
-    overview_data.append([])
-    overview_data.append([])
+    adicionar_linha(["TOTAL DE ITENS NO RELATÓRIO:", agregados['total_linhas']], 'rotulos')
+    adicionar_linha(["ITENS EM ESTOQUE (IN STOCK):", in_stock_count], 'rotulos')
+    adicionar_linha(["REQUISIÇÕES DE COMPRA (PURREQUIST):", purrequist_count], 'rotulos')
+    adicionar_linha(["ORDENS CONFIRMADAS (POCONFIRM):", poconfirm_count], 'rotulos')
+    adicionar_linha(["ORDENS CRIADAS (POCREATED):", pocreated_count], 'rotulos')
+    adicionar_linha([])
+    adicionar_linha([])
     
     # 1. Contagem Cruzada de STATUS_STYPE por Equipment
-    if 'STATUS_STYPE' in df.columns and 'Equipment' in df.columns:
-        overview_data.append(["CONTAGEM CRUZADA - STATUS_STYPE POR EQUIPAMENTO"])
-        overview_data.append([])
+    if agregados['cruzada'] is not None:
+        adicionar_linha(["CONTAGEM CRUZADA - STATUS_STYPE POR EQUIPAMENTO"], 'titulos')
+        adicionar_linha([])
         
-        contagem_cruzada = pd.crosstab(df['Equipment'], df['STATUS_STYPE'], margins=True, margins_name="TOTAL")
+        contagem_cruzada = _tabela_cruzada(agregados['cruzada'])
         
         # Adicionar cabeçalho
         header = ["EQUIPMENT"] + [str(col).upper() for col in contagem_cruzada.columns]
-        overview_data.append(header)
+        adicionar_linha(header, 'cabecalhos')
+        fechar_linhas()
         
-        # Adicionar dados
-        for equipamento in contagem_cruzada.index:
-            linha = [equipamento]
-            for stype in contagem_cruzada.columns:
-                linha.append(contagem_cruzada.loc[equipamento, stype])
-            overview_data.append(linha)
+        # Adicionar dados como um bloco de colunas (a última linha é a de totais)
+        adicionar_bloco(_bloco_overview(
+            contagem_cruzada.index,
+            *(contagem_cruzada[stype] for stype in contagem_cruzada.columns)
+        ))
+        layout['rotulos'].append((linhas_blocos - 1, 1))
         
-        overview_data.append([])
-        overview_data.append([])
+        adicionar_linha([])
+        adicionar_linha([])
     
     # 2. Itens com atraso Top 15 - VERSÃO SIMPLIFICADA
-    overview_data.append(["ITENS COM ATRASO - TOP 15"])
-    overview_data.append(["MATERIAL_NO", "MATERIAL_DESCRIPTION", "FLOAT(TODAY-OPENING)"])
+    adicionar_linha(["ITENS COM ATRASO - TOP 15"], 'titulos')
+    adicionar_linha(["MATERIAL_NO", "MATERIAL_DESCRIPTION", "FLOAT(TODAY-OPENING)"], 'cabecalhos')
     
-    if all(col in df.columns for col in ['MATERIAL_NO', 'MATERIAL_DESCRIPTION', 'Float(Today-Opening)']):
-        # Criar cópia do DataFrame
-        df_atraso = df.copy()
-        
-        # Converter a coluna Float(Today-Opening) para numérico
-        df_atraso['Float(Today-Opening)'] = pd.to_numeric(df_atraso['Float(Today-Opening)'], errors='coerce')
-        
-        # Remover linhas com valores NaN na coluna Float(Today-Opening)
-        df_atraso = df_atraso.dropna(subset=['Float(Today-Opening)'])
-        
-        # Ordenar do menor para o maior (incluindo valores negativos)
-        df_atraso = df_atraso.sort_values('Float(Today-Opening)', ascending=True)
-        
-        # Pegar os 15 primeiros itens
-        top_atraso = df_atraso.head(15)[['MATERIAL_NO', 'MATERIAL_DESCRIPTION', 'Float(Today-Opening)']]
-        
-        # Adicionar à overview
-        for _, row in top_atraso.iterrows():
-            overview_data.append([
-                row['MATERIAL_NO'],
-                row['MATERIAL_DESCRIPTION'],
-                row['Float(Today-Opening)']
-            ])
+    if agregados['atraso'] is not None:
+        fechar_linhas()
+        adicionar_bloco(agregados['atraso'])
     else:
-        overview_data.append(["COLUNAS NECESSÁRIAS PARA ANÁLISE DE ATRASO NÃO ENCONTRADAS"])
+        adicionar_linha(["COLUNAS NECESSÁRIAS PARA ANÁLISE DE ATRASO NÃO ENCONTRADAS"])
     
-    overview_data.append([])
-    overview_data.append([])
+    adicionar_linha([])
+    adicionar_linha([])
     
     # 3. Itens de Montagem (E) próximo período
-    overview_data.append(["ITENS DE MONTAGEM (E) - PRÓXIMOS 3 MESES"])
-    overview_data.append(["MATERIAL_NO", "MATERIAL_DESCRIPTION", "OPENING_DATE"])
+    adicionar_linha(["ITENS DE MONTAGEM (E) - PRÓXIMOS 3 MESES"], 'titulos')
+    adicionar_linha(["MATERIAL_NO", "MATERIAL_DESCRIPTION", "OPENING_DATE"], 'cabecalhos')
     
-    if all(col in df.columns for col in ['PROCUREMENT_KEY', 'MATERIAL_NO', 'MATERIAL_DESCRIPTION', 'OPENING_DATE']):
-        df_montagem = df[df['PROCUREMENT_KEY'] == 'E'].copy()
-        
-        if not df_montagem.empty:
-            # Converter OPENING_DATE para datetime
-            df_montagem['OPENING_DATE_DT'] = pd.to_datetime(df_montagem['OPENING_DATE'], format='%d/%m/%Y', errors='coerce')
-            
-            # Filtrar para próximos 3 meses
-            hoje = datetime.now()
-            tres_meses = hoje + timedelta(days=90)
-            
-            df_montagem_filtrado = df_montagem[
-                (df_montagem['OPENING_DATE_DT'] >= hoje) & 
-                (df_montagem['OPENING_DATE_DT'] <= tres_meses)
-            ].copy()
-            
-            if not df_montagem_filtrado.empty:
-                # Ordenar da menor data para a maior
-                df_montagem_filtrado = df_montagem_filtrado.sort_values('OPENING_DATE_DT', ascending=True)
-                
-                for _, row in df_montagem_filtrado.iterrows():
-                    overview_data.append([
-                        row['MATERIAL_NO'],
-                        row['MATERIAL_DESCRIPTION'],
-                        row['OPENING_DATE']
-                    ])
-            else:
-                overview_data.append(["NÃO HÁ MONTAGENS PREVISTAS PARA O PERÍODO DE 90 DIAS"])
-                overview_data.append([])
-        else:
-            overview_data.append(["NÃO HÁ ITENS DE MONTAGEM (PROCUREMENT_KEY = 'E') NO ARQUIVO"])
-            overview_data.append([])
+    if agregados['montagem'] is None:
+        adicionar_linha(["COLUNAS NECESSÁRIAS PARA ANÁLISE DE MONTAGEM NÃO ENCONTRADAS"])
+        adicionar_linha([])
+    elif not agregados['total_montagem']:
+        adicionar_linha(["NÃO HÁ ITENS DE MONTAGEM (PROCUREMENT_KEY = 'E') NO ARQUIVO"])
+        adicionar_linha([])
+    elif agregados['montagem'].empty:
+        adicionar_linha(["NÃO HÁ MONTAGENS PREVISTAS PARA O PERÍODO DE 90 DIAS"])
+        adicionar_linha([])
     else:
-        overview_data.append(["COLUNAS NECESSÁRIAS PARA ANÁLISE DE MONTAGEM NÃO ENCONTRADAS"])
-        overview_data.append([])
+        # Ordenar da menor data para a maior
+        montagem = agregados['montagem']
+        ordem = np.argsort(montagem[2].to_numpy(dtype='datetime64[ns]'), kind='stable')
+        
+        fechar_linhas()
+        adicionar_bloco(montagem.iloc[ordem].reset_index(drop=True))
     
     # Converter para DataFrame
-    df_overview = pd.DataFrame(overview_data)
+    fechar_linhas()
+    df_overview = pd.concat(blocos, ignore_index=True)
+    df_overview.attrs['layout'] = layout
     
     return df_overview
 
-def aplicar_fonte_global(worksheet):
-    """Aplica fonte Aptos Narrow tamanho 11 para todas as células da worksheet"""
-    for row in worksheet.iter_rows():
-        for cell in row:
-            # Manter o negrito existente se já estiver aplicado, mas alterar a fonte e tamanho
-            current_bold = cell.font.bold if cell.font else False
-            cell.font = Font(name='Aptos Narrow', size=11, bold=current_bold)
-
-def aplicar_formato_overview(worksheet):
-    """Aplica formatação específica para a aba Overview - apenas negrito em títulos e cabeçalhos"""
-    for row in worksheet.iter_rows():
-        for cell in row:
-            # Formatar títulos principais e cabeçalhos de tabela em negrito
-            if cell.value and any(titulo in str(cell.value) for titulo in [
-                "RELATÓRIO DE PLANEJAMENTO - VISÃO GERAL",
-                "Relatório gerado em:",
-                "ESTATÍSTICAS RÁPIDAS",
-                "CONTAGEM CRUZADA - STATUS_STYPE POR EQUIPAMENTO", 
-                "ITENS COM ATRASO - TOP 15",
-                "ITENS DE MONTAGEM (E) - PRÓXIMOS 3 MESES"
-            ]):
-                cell.font = Font(name='Aptos Narrow', size=11, bold=True)
-                
-            # Formatar cabeçalhos de colunas em negrito
-            elif cell.value and str(cell.value) in ["EQUIPMENT", "MATERIAL_NO", "MATERIAL_DESCRIPTION", 
-                                                   "FLOAT(TODAY-OPENING)", "OPENING_DATE", "TOTAL"]:
-                cell.font = Font(name='Aptos Narrow', size=11, bold=True)
-                
-            # Formatar estatísticas rápidas em negrito
-            elif cell.value and any(stat in str(cell.value) for stat in [
-                "TOTAL DE ITENS NO RELATÓRIO:",
-                "ITENS EM ESTOQUE (IN STOCK):",
-                "REQUISIÇÕES DE COMPRA (PURREQUIST):",
-                "ORDENS CONFIRMADAS (POCONFIRM):",
-                "ORDENS CRIADAS (POCREATED):"
-            ]):
-                cell.font = Font(name='Aptos Narrow', size=11, bold=True)
-
-def aplicar_formato_condicional(worksheet, df):
-    """Aplica formatação condicional baseada nas regras especificadas"""
-    
-    # Obter índices das colunas relevantes
-    header = [cell.value for cell in worksheet[1]]
-    
-    # Encontrar índices das colunas que precisamos
-    col_procurement_key = None
-    col_demand = None
-    col_status = None
-    
-    for idx, cell in enumerate(worksheet[1]):
-        if cell.value == "PROCUREMENT_KEY":
-            col_procurement_key = idx
-        elif cell.value == "DEMAND":
-            col_demand = idx
-        elif cell.value == "Status":
-            col_status = idx
+def posicoes_negrito_overview(df_overview):
+    """Colunas em negrito de cada linha da Overview (linha -> quantidade de colunas), a partir do layout"""
+    negrito = {}
+    for tipo in TIPOS_LINHA_OVERVIEW:
+        for linha, colunas in df_overview.attrs.get('layout', {}).get(tipo, []):
+            negrito[linha] = max(negrito.get(linha, 0), colunas)
+    return negrito
+
+class VisaoAba:
+    """Aba de dados vista sobre o DataFrame do relatório, sem copiar linhas nem colunas
+    
+    `linhas` são as posições das linhas no DataFrame (todas, quando None) e
+    `colunas` os nomes das colunas da aba (todas, quando None). Os escritores
+    leem a aba coluna a coluna ou em blocos de linhas, e só esses pedaços
+    são materializados.
+    """
+    
+    def __init__(self, df, linhas=None, colunas=None):
+        self.df = df
+        self.linhas = linhas
+        if colunas is None:
+            self.colunas = list(df.columns)
+            self._posicoes_colunas = np.arange(len(df.columns))
+        else:
+            self.colunas = list(colunas)
+            self._posicoes_colunas = df.columns.get_indexer(self.colunas)
+    
+    def __len__(self):
+        return len(self.df) if self.linhas is None else len(self.linhas)
+    
+    @property
+    def size(self):
+        return len(self) * len(self.colunas)
+    
+    @property
+    def posicoes(self):
+        """Posição de cada linha da aba no DataFrame do relatório"""
+        return np.arange(len(self.df)) if self.linhas is None else self.linhas
+    
+    def serie(self, posicao):
+        """Coluna da aba (pela posição na aba), apenas com as linhas da aba"""
+        serie = self.df.iloc[:, self._posicoes_colunas[posicao]]
+        return serie if self.linhas is None else serie.iloc[self.linhas]
+    
+    def bloco(self, inicio, fim):
+        """DataFrame com as linhas [inicio, fim) da aba"""
+        linhas = slice(inicio, fim) if self.linhas is None else self.linhas[inicio:fim]
+        return self.df.iloc[linhas, self._posicoes_colunas]
+
+def como_visao(aba):
+    """Trata DataFrames e VisaoAba da mesma forma"""
+    return aba if isinstance(aba, VisaoAba) else VisaoAba(aba)
+
+def como_dataframe(aba):
+    """DataFrame da aba (materializa a VisaoAba; usado apenas pelos motores que exigem cópia)"""
+    return aba.bloco(0, len(aba)) if isinstance(aba, VisaoAba) else aba
+
+def calcular_larguras_colunas(df, incluir_cabecalho=True):
+    """Calcula a largura de cada coluna a partir do DataFrame ou VisaoAba (limite de 35 caracteres)"""
+    aba = como_visao(df)
+    larguras = []
+    for posicao, coluna in enumerate(aba.colunas):
+        valores = aba.serie(posicao).dropna()
+        if pd.api.types.is_datetime64_any_dtype(valores):
+            # Datas são exibidas como DD/MM/YYYY
+            max_length = len(FORMATO_DATA_EXCEL) if len(valores) else 0
+        else:
+            max_length = int(valores.astype(str).str.len().max()) if len(valores) else 0
+        if incluir_cabecalho and coluna is not None:
+            max_length = max(max_length, len(str(coluna)))
+        larguras.append(min(max_length + 2, LARGURA_MAXIMA_COLUNA))
+    return larguras
+
+def ajustar_larguras_colunas(worksheet, df, incluir_cabecalho=True, larguras=None):
+    """Ajusta a largura das colunas com limite de 270 pixels (35 caracteres)"""
+    if larguras is None:
+        larguras = calcular_larguras_colunas(df, incluir_cabecalho)
+    for idx, largura in enumerate(larguras, 1):
+        worksheet.column_dimensions[get_column_letter(idx)].width = largura
+
+def _criar_estilo(worksheet, font, fill=None):
+    """Registra fonte e preenchimento no workbook e devolve o estilo compartilhado da célula"""
+    celula = WriteOnlyCell(worksheet)
+    celula.font = font
+    if fill is not None:
+        celula.fill = fill
+    return celula._style
+
+def _com_formato_numerico(worksheet, estilo, formato):
+    """Devolve uma cópia do estilo com o formato numérico informado"""
+    celula = WriteOnlyCell(worksheet)
+    celula._style = copy(estilo)
+    celula.number_format = formato
+    return celula._style
+
+def criar_estilos_relatorio(worksheet):
+    """Cria uma única vez os estilos usados pelo relatório
+    
+    Fontes e preenchimentos são registrados no workbook apenas aqui; as células
+    recebem cópias destes estilos em vez de um novo `Font` por célula.
+    """
+    # Um estilo por classe de linha, na mesma ordem de CLASSES_LINHA
+    classes = [
+        _criar_estilo(worksheet, CORES.get(f'{classe}_font', FONTE_PADRAO), CORES.get(classe))
+        for classe in CLASSES_LINHA
+    ]
+    return {
+        'cabecalho': _criar_estilo(worksheet, CORES['cabecalho_font'], CORES['cabecalho_fill']),
+        'negrito': _criar_estilo(worksheet, FONTE_NEGRITO),
+        'classes': classes,
+        # Mesmas classes com o formato numérico de data
+        'classes_data': [_com_formato_numerico(worksheet, estilo, FORMATO_DATA_EXCEL) for estilo in classes],
+    }
+
+def _estilo_diferencial(classe):
+    """Fonte e preenchimento da classe de linha para a formatação condicional"""
+    fonte = CORES.get(f'{classe}_font')
+    return DifferentialStyle(font=Font(color=fonte.color) if fonte is not None else None,
+                             fill=CORES[classe])
+
+def registrar_estilos_condicionais(workbook):
+    """Registra em ordem fixa os estilos das regras de formatação condicional"""
+    for classe in CLASSES_LINHA[1:]:
+        workbook._differential_styles.add(_estilo_diferencial(classe))
+
+def aplicar_regras_condicionais_excel(worksheet, colunas, total_linhas):
+    """Grava as regras de cor como formatação condicional do Excel sobre as linhas de dados
+    
+    Uma regra por coluna de REGRAS_COR existente na aba, na mesma ordem de
+    prioridade e com "parar se verdadeiro", para que só a primeira se aplique.
+    """
+    if not colunas or not total_linhas:
+        return
+    intervalo = f"A2:{get_column_letter(len(colunas))}{total_linhas + 1}"
+    for coluna, classe in REGRAS_COR:
+        if coluna not in colunas:
+            continue
+        celula = f"${get_column_letter(colunas.index(coluna) + 1)}2"
+        worksheet.conditional_formatting.add(intervalo, FormulaRule(
+            formula=[FORMULAS_REGRAS_COR[classe].format(celula=celula)],
+            font=_estilo_diferencial(classe).font,
+            fill=CORES[classe],
+            stopIfTrue=True,
+        ))
+
+def _criar_workbook_escrita():
+    """Workbook write_only com Aptos Narrow como fonte padrão (inclusive em células sem estilo)"""
+    workbook = Workbook(write_only=True)
+    workbook._fonts = IndexedList([FONTE_PADRAO])
+    return workbook
+
+def _aplicar_estilo(cell, estilo):
+    """Aplica um estilo compartilhado à célula mantendo seu formato numérico"""
+    formato = cell._style.numFmtId if cell.has_style else 0
+    cell._style = copy(estilo)
+    cell._style.numFmtId = formato
+
+def aplicar_formato_overview(worksheet, df_overview, estilos):
+    """Aplica negrito apenas nas posições de títulos, cabeçalhos e rótulos e ajusta a largura
+    
+    As demais células ficam com a fonte padrão do workbook.
+    """
+    for linha, colunas in posicoes_negrito_overview(df_overview).items():
+        for coluna in range(1, colunas + 1):
+            _aplicar_estilo(worksheet.cell(row=linha + 1, column=coluna), estilos['negrito'])
+    
+    # Datas (montagens previstas) no formato DD/MM/YYYY, como no motor em streaming
+    for posicao, coluna in enumerate(df_overview.columns):
+        valores = df_overview[coluna].to_numpy()
+        for linha in np.flatnonzero([isinstance(valor, datetime) for valor in valores]):
+            worksheet.cell(row=linha + 1, column=posicao + 1)._style = copy(estilos['classes_data'][0])
+    
+    ajustar_larguras_colunas(worksheet, df_overview, incluir_cabecalho=False)
+
+def calcular_regras_condicionais(df):
+    """Avalia uma única vez, sobre o DataFrame completo, as três regras de cor"""
+    regras = pd.DataFrame(index=df.index)
+    
+    # 1. Status = "In Stock" (maior prioridade)
+    if 'Status' in df.columns:
+        regras['Status'] = (df['Status'] == 'In Stock').to_numpy(dtype=bool, na_value=False)
+    
+    # 2. DEMAND começa com "R"
+    if 'DEMAND' in df.columns:
+        demand = df['DEMAND']
+        regras['DEMAND'] = (demand.notna() & demand.astype(str).str.startswith('R')).to_numpy(dtype=bool, na_value=False)
+    
+    # 3. PROCUREMENT_KEY = "E"
+    if 'PROCUREMENT_KEY' in df.columns:
+        regras['PROCUREMENT_KEY'] = (df['PROCUREMENT_KEY'] == 'E').to_numpy(dtype=bool, na_value=False)
+    
+    return regras
+
+def classificar_linhas(df, regras=None):
+    """Retorna um array com a classe de cor de cada linha (índice em CLASSES_LINHA)
+    
+    Apenas as regras cujas colunas existem na aba são consideradas. Quando
+    `regras` é informado (calculado sobre o DataFrame completo), as linhas da
+    aba são buscadas pela posição em vez de reavaliar as condições.
+    """
+    aba = como_visao(df)
+    if regras is None:
+        regras = calcular_regras_condicionais(aba.df)
+    
+    condicoes = []
+    classes = []
+    for coluna, classe in REGRAS_COR:
+        if coluna in aba.colunas and coluna in regras.columns:
+            valores = regras[coluna].to_numpy()
+            condicoes.append(valores if aba.linhas is None else valores[aba.linhas])
+            classes.append(CLASSES_LINHA.index(classe))
+    
+    if not condicoes:
+        return np.zeros(len(aba), dtype=np.int8)
+    return np.select(condicoes, classes, default=0).astype(np.int8)
+
+def aplicar_formato_condicional(worksheet, df, estilos, regras=None, formatacao='celulas'):
+    """Aplica em uma única passagem fonte, formatação condicional e largura das colunas"""
+    linhas = worksheet.iter_rows()
     
     # Formatar cabeçalho
-    for cell in worksheet[1]:
-        cell.fill = CORES['cabecalho_fill']
-        cell.font = CORES['cabecalho_font']
-    
-    # Aplicar formatação condicional às linhas de dados
-    for row in worksheet.iter_rows(min_row=2):
-        # Verificar condições na ordem de prioridade
-        
-        # 1. Status = "In Stock" (maior prioridade)
-        if col_status is not None:
-            status_cell = row[col_status]
-            if status_cell.value == "In Stock":
-                for cell in row:
-                    cell.fill = CORES['in_stock']
-                continue  # Pula para próxima linha
-        
-        # 2. DEMAND começa com "R"
-        if col_demand is not None:
-            demand_cell = row[col_demand]
-            if demand_cell.value and str(demand_cell.value).startswith('R'):
-                for cell in row:
-                    cell.fill = CORES['demand_r']
-                    cell.font = CORES['demand_r_font']
-                continue  # Pula para próxima linha
-        
-        # 3. PROCUREMENT_KEY = "E"
-        if col_procurement_key is not None:
-            procurement_cell = row[col_procurement_key]
-            if procurement_cell.value == "E":
-                for cell in row:
-                    cell.fill = CORES['procurement_e']
-
-def aplicar_formato_excel(writer, df_dict):
+    for cell in next(linhas, ()):
+        _aplicar_estilo(cell, estilos['cabecalho'])
+    
+    # Classe de cada linha calculada de forma vetorizada, na mesma ordem da planilha
+    if formatacao == 'condicional':
+        # As cores ficam nas regras do Excel; as células recebem apenas a fonte
+        classes = np.zeros(len(df), dtype=np.int8)
+        aplicar_regras_condicionais_excel(worksheet, como_visao(df).colunas, len(df))
+    else:
+        classes = classificar_linhas(df, regras)
+    
+    # Aplicar fonte e formatação condicional às linhas de dados; colunas de data
+    # recebem o estilo com o formato DD/MM/YYYY (o ExcelWriter grava data e hora)
+    aba = como_visao(df)
+    eh_data = [pd.api.types.is_datetime64_any_dtype(aba.serie(idx)) for idx in range(len(aba.colunas))]
+    for row, classe in zip(linhas, classes):
+        estilo = estilos['classes'][classe]
+        estilo_data = estilos['classes_data'][classe]
+        for cell, data in zip(row, eh_data):
+            if data:
+                cell._style = copy(estilo_data)
+            else:
+                _aplicar_estilo(cell, estilo)
+    
+    ajustar_larguras_colunas(worksheet, df)
+
+def aplicar_formato_excel(writer, df_dict, regras=None, perfil=None, formatacao='celulas'):
     """Aplica formatação colorida ao arquivo Excel baseada nas condições especificadas"""
     workbook = writer.book
+    estilos = None
     
     for sheet_name in df_dict:
         worksheet = workbook[sheet_name]
+        if estilos is None:
+            estilos = criar_estilos_relatorio(worksheet)
         
-        # Aplicar fonte Aptos Narrow tamanho 11 para todas as células
-        aplicar_fonte_global(worksheet)
-        
+        df_aba = df_dict[sheet_name]
+        with _etapa(perfil, f'formatação: {sheet_name}', len(df_aba), df_aba.size):
+            if sheet_name != 'Overview':
+                # Aplicar formatação específica para outras abas
+                aplicar_formato_condicional(worksheet, df_aba, estilos, _regras_da_aba(sheet_name, regras),
+                                            formatacao)
+            else:
+                # Aplicar formatação específica para Overview (apenas negrito em títulos)
+                aplicar_formato_overview(worksheet, df_aba, estilos)
+
+def _linhas_em_blocos(df, tamanho_bloco=TAMANHO_BLOCO_ESCRITA):
+    """Gera as linhas do DataFrame ou VisaoAba em blocos, trocando valores nulos por None"""
+    aba = como_visao(df)
+    for inicio in range(0, len(aba), tamanho_bloco):
+        bloco = aba.bloco(inicio, inicio + tamanho_bloco).astype(object)
+        bloco = bloco.where(bloco.notna(), None)
+        yield from bloco.itertuples(index=False, name=None)
+
+def _celula_estilizada(worksheet, valor, estilo):
+    """Cria uma célula de escrita com estilo pré-calculado"""
+    # O estilo é copiado antes do valor para preservar o formato numérico de datas
+    celula = WriteOnlyCell(worksheet)
+    celula._style = copy(estilo)
+    celula.value = valor
+    return celula
+
+def _preparar_aba_dados(worksheet, df, larguras=None, total_linhas=None):
+    """Define larguras, filtro e congelamento (antes da primeira linha no modo write_only)
+    
+    No modo em blocos, `larguras` e `total_linhas` vêm da primeira passagem.
+    """
+    ajustar_larguras_colunas(worksheet, df, larguras=larguras)
+    if total_linhas is None:
+        total_linhas = len(df)
+    ultima_coluna = get_column_letter(max(len(como_visao(df).colunas), 1))
+    worksheet.auto_filter.ref = f"A1:{ultima_coluna}{total_linhas + 1}"
+    worksheet.freeze_panes = 'A2'
+
+def _estilos_colunas(estilos, eh_data):
+    """Estilos de cada coluna por classe (colunas de data recebem o formato DD/MM/YYYY)"""
+    return [
+        [estilo_data if data else estilo for data in eh_data]
+        for estilo, estilo_data in zip(estilos['classes'], estilos['classes_data'])
+    ]
+
+def _escrever_linhas_dados(worksheet, df, estilos_colunas, classes):
+    """Acrescenta as linhas do DataFrame com o estilo da classe de cada uma
+    
+    Colunas com estilo None recebem o valor puro (fonte padrão do workbook).
+    """
+    for valores, classe in zip(_linhas_em_blocos(df), classes):
+        worksheet.append([
+            valor if estilo is None else _celula_estilizada(worksheet, valor, estilo)
+            for valor, estilo in zip(valores, estilos_colunas[classe])
+        ])
+
+def _estilos_colunas_condicional(estilos, eh_data):
+    """Estilos de cada coluna quando as cores são regras do Excel: só as datas precisam de estilo"""
+    return [[estilos['classes_data'][0] if data else None for data in eh_data]]
+
+def _escrever_aba_dados_streaming(worksheet, df, estilos, regras=None, formatacao='celulas'):
+    """Escreve uma aba de dados já formatada (cabeçalho, cores, filtro e congelamento)"""
+    df = como_visao(df)
+    colunas = df.colunas
+    _preparar_aba_dados(worksheet, df)
+    
+    if not colunas:
+        return
+    
+    eh_data = [pd.api.types.is_datetime64_any_dtype(df.serie(idx)) for idx in range(len(colunas))]
+    if formatacao == 'condicional':
+        aplicar_regras_condicionais_excel(worksheet, colunas, len(df))
+        classes = np.zeros(len(df), dtype=np.int8)
+        estilos_colunas = _estilos_colunas_condicional(estilos, eh_data)
+    else:
+        classes = classificar_linhas(df, regras)
+        estilos_colunas = _estilos_colunas(estilos, eh_data)
+    
+    worksheet.append([_celula_estilizada(worksheet, col, estilos['cabecalho']) for col in colunas])
+    _escrever_linhas_dados(worksheet, df, estilos_colunas, classes)
+
+def _escrever_aba_overview_streaming(worksheet, df_overview, estilos):
+    """Escreve a aba Overview com negrito nos títulos e cabeçalhos"""
+    ajustar_larguras_colunas(worksheet, df_overview, incluir_cabecalho=False)
+    
+    negrito = posicoes_negrito_overview(df_overview)
+    estilo_data = estilos['classes_data'][0]
+    for linha, valores in enumerate(_linhas_em_blocos(df_overview)):
+        colunas_negrito = negrito.get(linha, 0)
+        worksheet.append([
+            _celula_estilizada(worksheet, valor, estilos['negrito']) if coluna < colunas_negrito
+            else _celula_estilizada(worksheet, valor, estilo_data) if isinstance(valor, datetime)
+            else valor
+            for coluna, valor in enumerate(valores)
+        ])
+
+def _regras_da_aba(sheet_name, regras):
+    """Regras calculadas sobre o relatório valem apenas para as abas recortadas dele"""
+    return None if sheet_name == ABA_ALTERACOES else regras
+
+def _escrever_aba_streaming(worksheet, sheet_name, df_aba, estilos, regras=None, formatacao='celulas'):
+    """Escreve uma aba no modo write_only conforme o tipo (Overview ou dados)"""
+    if sheet_name == 'Overview':
+        _escrever_aba_overview_streaming(worksheet, df_aba, estilos)
+    else:
+        _escrever_aba_dados_streaming(worksheet, df_aba, estilos, _regras_da_aba(sheet_name, regras),
+                                      formatacao)
+
+def escrever_excel_streaming(output, df_dict, regras=None, perfil=None, formatacao='celulas'):
+    """Escreve e formata todas as abas em uma única passagem (openpyxl write_only)"""
+    workbook = _criar_workbook_escrita()
+    estilos = None
+    
+    for sheet_name, df_aba in df_dict.items():
+        worksheet = workbook.create_sheet(sheet_name)
+        if estilos is None:
+            estilos = criar_estilos_relatorio(worksheet)
+        with _etapa(perfil, f'escrita e formatação: {sheet_name}', len(df_aba), df_aba.size):
+            _escrever_aba_streaming(worksheet, sheet_name, df_aba, estilos, regras, formatacao)
+    
+    with _etapa(perfil, 'gravação do .xlsx'):
+        workbook.save(output)
+
+def _registrar_todos_estilos(worksheet):
+    """Cria os estilos do relatório e registra, em ordem fixa, todas as combinações com formatos de data
+    
+    Assim a tabela de estilos (styles.xml) de cada processo é idêntica,
+    independente de quais valores aparecem na aba renderizada.
+    """
+    estilos = criar_estilos_relatorio(worksheet)
+    registrar_estilos_condicionais(worksheet.parent)
+    formatos = ['General', FORMATO_DATA_EXCEL] + list(TIME_FORMATS.values())
+    for estilo in [estilos['cabecalho'], estilos['negrito']] + estilos['classes']:
+        for formato in formatos:
+            celula = WriteOnlyCell(worksheet)
+            celula._style = copy(estilo)
+            celula.number_format = formato
+            celula.style_id
+    return estilos
+
+def _renderizar_aba_isolada(sheet_name, df_aba, regras=None, formatacao='celulas'):
+    """Renderiza uma única aba em um workbook próprio (executado em outro processo)
+    
+    Retorna o XML da aba, o styles.xml do workbook temporário e o tempo gasto.
+    """
+    inicio = time.perf_counter()
+    workbook = _criar_workbook_escrita()
+    worksheet = workbook.create_sheet(sheet_name)
+    estilos = _registrar_todos_estilos(worksheet)
+    _escrever_aba_streaming(worksheet, sheet_name, df_aba, estilos, regras, formatacao)
+    
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    with zipfile.ZipFile(buffer) as pacote:
+        partes = pacote.read('xl/worksheets/sheet1.xml'), pacote.read('xl/styles.xml')
+    return partes + (time.perf_counter() - inicio,)
+
+def escrever_excel_paralelo(output, df_dict, regras=None, perfil=None, formatacao='celulas'):
+    """Renderiza cada aba em um processo separado e monta o .xlsx a partir das partes
+    
+    As abas usam inline strings e a mesma tabela de estilos, então o XML de
+    cada uma pode ser gerado de forma independente. O pacote final (workbook,
+    relações, filtros) vem de um workbook esqueleto com as mesmas abas vazias.
+    Se as tabelas de estilos divergirem, o arquivo é escrito em sequência.
+    """
+    max_workers = max(min(len(df_dict), os.cpu_count() or 1), 1)
+    with _etapa(perfil, 'escrita e formatação em processos paralelos', celulas=sum(
+            df_aba.size for df_aba in df_dict.values())), \
+            ProcessPoolExecutor(max_workers=max_workers,
+                                mp_context=multiprocessing.get_context('spawn')) as executor:
+        futuros = []
+        for sheet_name, df_aba in df_dict.items():
+            # Cada processo recebe apenas as linhas da sua aba (cópia inevitável para enviá-las)
+            regras_aba = None
+            if _regras_da_aba(sheet_name, regras) is not None and sheet_name != 'Overview':
+                regras_aba = regras.iloc[como_visao(df_aba).posicoes]
+            futuros.append(executor.submit(_renderizar_aba_isolada, sheet_name,
+                                           como_dataframe(df_aba), regras_aba, formatacao))
+        partes = [futuro.result() for futuro in futuros]
+    
+    # Tempo de cada aba medido dentro do seu processo
+    if perfil is not None:
+        for (sheet_name, df_aba), (_, _, segundos) in zip(df_dict.items(), partes):
+            perfil.registrar(f'escrita e formatação (processo): {sheet_name}', segundos,
+                             len(df_aba), df_aba.size)
+    
+    if len({estilos for _, estilos, _ in partes}) > 1:
+        escrever_excel_streaming(output, df_dict, regras, perfil, formatacao)
+        return
+    
+    # Esqueleto com as abas vazias, mas com os mesmos filtros (nomes definidos no workbook.xml)
+    esqueleto = _criar_workbook_escrita()
+    for sheet_name, df_aba in df_dict.items():
+        worksheet = esqueleto.create_sheet(sheet_name)
         if sheet_name != 'Overview':
-            # Aplicar formatação específica para outras abas
-            aplicar_formato_condicional(worksheet, df_dict[sheet_name])
-        else:
-            # Aplicar formatação específica para Overview (apenas negrito em títulos)
-            aplicar_formato_overview(worksheet)
-        
-        # Ajustar largura das colunas com limite de 270 pixels (35 caracteres)
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
+            _preparar_aba_dados(worksheet, df_aba)
+    buffer = io.BytesIO()
+    esqueleto.save(buffer)
+    
+    substituicoes = {f'xl/worksheets/sheet{idx}.xml': xml for idx, (xml, _, _) in enumerate(partes, 1)}
+    substituicoes['xl/styles.xml'] = partes[0][1]
+    with _etapa(perfil, 'gravação do .xlsx'), zipfile.ZipFile(buffer) as origem, \
+            zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as destino:
+        for item in origem.infolist():
+            destino.writestr(item, substituicoes.get(item.filename) or origem.read(item.filename))
+
+def escrever_excel_openpyxl(output, df_dict, regras=None, perfil=None, formatacao='celulas'):
+    """Escreve o arquivo com o ExcelWriter do pandas e aplica a formatação célula a célula"""
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        # Aptos Narrow como fonte padrão, também nas células que não recebem estilo
+        writer.book._fonts = IndexedList([FONTE_PADRAO])
+        
+        # Salvar as abas na ordem desejada
+        for sheet_name, df_aba in df_dict.items():
+            with _etapa(perfil, f'escrita: {sheet_name}', len(df_aba), df_aba.size):
+                como_dataframe(df_aba).to_excel(writer, sheet_name=sheet_name, index=False,
+                                                header=(sheet_name != 'Overview'))
+        
+        # Aplicar formatação
+        aplicar_formato_excel(writer, df_dict, regras, perfil, formatacao)
+        
+        # Formatação básica (filtros e congelamento)
+        for sheet_name in writer.sheets:
+            worksheet = writer.sheets[sheet_name]
+            if sheet_name != 'Overview':  # Não aplicar filtro na Overview
+                worksheet.auto_filter.ref = worksheet.dimensions
+                worksheet.freeze_panes = 'A2'
+        
+        # A gravação do arquivo acontece ao fechar o ExcelWriter
+        inicio_gravacao = time.perf_counter()
+    
+    if perfil is not None:
+        perfil.registrar('gravação do .xlsx', time.perf_counter() - inicio_gravacao)
+
+def preparar_relatorio(df, perfil=None, formatos_data=None):
+    """Converte as colunas de data e ordena o relatório por Counter
+    
+    `formatos_data` (dict) guarda os formatos de data inferidos; é informado
+    quando o mesmo arquivo é preparado em partes (blocos).
+    """
+    if formatos_data is None:
+        formatos_data = {}
+    
+    # Converter colunas de data
+    with _etapa(perfil, 'conversão de datas', linhas=len(df)):
+        for col in COLUNAS_DATA:
+            if col in df.columns:
                 try:
-                    if cell.value:
-                        cell_length = len(str(cell.value))
-                        max_length = max(max_length, cell_length)
+                    # Mantidas como datetime64; o formato DD/MM/YYYY é aplicado na escrita
+                    df[col] = converter_coluna_data(df[col], col, formatos_data)
                 except:
                     pass
-            adjusted_width = min(max_length + 2, 35)
-            worksheet.column_dimensions[column_letter].width = adjusted_width
+    
+    # Ordenar por Counter se existir
+    if 'Counter' in df.columns:
+        with _etapa(perfil, 'ordenação por Counter', linhas=len(df)):
+            df['Counter'] = pd.to_numeric(df['Counter'], errors='coerce')
+            # Ordenação estável, igual à do modo em blocos
+            df = df.sort_values(by='Counter', ascending=True, kind='stable')
+    
+    return df
 
-def processar_arquivo(uploaded_file):
-    """Função principal para processar o arquivo"""
+def calcular_membros_abas(df):
+    """Indica, para cada linha do relatório, se ela entra em cada aba de ESPECIFICACOES_ABAS
     
-    # Lista de colunas de data para converter
-    colunas_data_especificas = [
-        "Data de necessidade", "Sup Date or Log Date", "OPENING_DATE", 
-        "Opening_Calculada", "PURCHASING_DOC_DATE", "DELIVERY_DATE", 
-        "SUPPLY_DATE", "REQUIRED_DATE", "Data_Atual"
-    ]
+    Abas cuja coluna de filtro não existe no relatório ficam de fora.
+    """
+    membros = pd.DataFrame(index=df.index)
+    for especificacao in ESPECIFICACOES_ABAS:
+        coluna, valores = especificacao['filtro']
+        if coluna in df.columns:
+            membros[especificacao['nome']] = df[coluna].isin(valores).to_numpy(dtype=bool, na_value=False)
+    return membros
+
+def colunas_das_abas(colunas):
+    """Colunas de cada aba de ESPECIFICACOES_ABAS presentes no relatório"""
+    return {
+        especificacao['nome']: [col for col in especificacao['colunas'] if col in colunas]
+        for especificacao in ESPECIFICACOES_ABAS
+    }
+
+def montar_abas(df, perfil=None):
+    """Monta as abas de ESPECIFICACOES_ABAS (RM, PO e Stock) como visões do relatório
+    
+    Cada aba é uma VisaoAba com as posições das suas linhas; nenhuma linha é
+    copiada. Abas cuja coluna de filtro não existe saem vazias.
+    """
+    membros = calcular_membros_abas(df)
+    
+    abas = {}
+    for nome_aba, colunas in colunas_das_abas(df.columns).items():
+        with _etapa(perfil, f'recorte {nome_aba}') as info:
+            if nome_aba in membros.columns:
+                abas[nome_aba] = VisaoAba(df, np.flatnonzero(membros[nome_aba].to_numpy()), colunas)
+            else:
+                abas[nome_aba] = VisaoAba(pd.DataFrame())
+            info['linhas'], info['celulas'] = len(abas[nome_aba]), abas[nome_aba].size
+    
+    return abas
+
+def _caminho_snapshot(base):
+    """Caminho do último processamento guardado para a base (nome livre)"""
+    chave = hashlib.sha256(str(base).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(DIRETORIO_CACHE, 'incremental', f"v{VERSAO_REGRAS}-{chave}.parquet")
+
+def carregar_snapshot(base):
+    """Carrega o último processamento da base (None se não houver)"""
+    caminho = _caminho_snapshot(base)
+    if not CACHE_PARQUET_DISPONIVEL or not os.path.exists(caminho):
+        return None
+    try:
+        anterior = pd.read_parquet(caminho)
+    except Exception:
+        return None
+    _marcar_uso_cache(caminho)
+    return anterior
+
+def salvar_snapshot(base, df, chaves, hashes):
+    """Guarda o relatório processado, com a chave e o hash de cada linha
+    
+    A tabela Parquet é montada direto do DataFrame, sem cópia dele; a chave e
+    o hash entram como colunas a mais (__chave e __hash).
+    """
+    if not CACHE_PARQUET_DISPONIVEL:
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    caminho = _caminho_snapshot(base)
+    # Colunas com tipos mistos não são aceitas pelo Parquet; nesse caso o próximo processamento sai sem a aba de alterações
+    try:
+        tabela = pa.Table.from_pandas(df, preserve_index=False)
+        tabela = tabela.append_column('__chave', pa.array(chaves)).append_column('__hash', pa.array(hashes))
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        pq.write_table(tabela, temporario)
+        del tabela
+        os.replace(temporario, caminho)
+    except Exception:
+        pass
+    _limpar_cache_disco(os.path.dirname(caminho), manter=caminho)
+
+def calcular_chaves_linhas(df):
+    """Hash da chave (Counter, MATERIAL_NO) e hash do conteúdo de cada linha"""
+    colunas_chave = [col for col in COLUNAS_CHAVE_INCREMENTAL if col in df.columns]
+    if not colunas_chave:
+        return None, None
+    chaves = pd.util.hash_pandas_object(df[colunas_chave], index=False).to_numpy()
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return chaves, hashes
+
+def _valores_diferentes(atual, anterior):
+    """Compara duas colunas posição a posição (nulos dos dois lados são iguais)"""
+    atual = atual.astype(object).to_numpy()
+    anterior = anterior.astype(object).to_numpy()
+    nulos = pd.isna(atual) & pd.isna(anterior)
+    return ~(nulos | (atual == anterior))
+
+def _formatar_valor_alteracao(valor):
+    """Texto de um valor na descrição de uma alteração"""
+    if pd.isna(valor):
+        return '(vazio)'
+    if isinstance(valor, (pd.Timestamp, datetime)):
+        return valor.strftime('%d/%m/%Y')
+    return str(valor)
+
+def montar_aba_alteracoes(df, anterior, novos, alterados, removidos, posicao_anterior):
+    """Monta a aba de alterações: linhas novas, alteradas (com o detalhe) e removidas"""
+    colunas = [col for col in COLUNAS_ALTERACOES if col in df.columns]
+    partes = []
+    
+    if novos.any():
+        parte = df.loc[novos, colunas].astype(object)
+        parte.insert(0, 'Tipo de alteração', 'Novo')
+        partes.append(parte)
+    
+    if alterados.any():
+        atual = df.loc[alterados]
+        antes = anterior.iloc[posicao_anterior[alterados]][df.columns]
+        diferencas = {col: _valores_diferentes(atual[col], antes[col]) for col in df.columns}
+        
+        colunas_alteradas = []
+        detalhes = []
+        for posicao in range(len(atual)):
+            nomes = [col for col in df.columns if diferencas[col][posicao]]
+            colunas_alteradas.append(', '.join(nomes))
+            detalhes.append('; '.join(
+                f"{col}: {_formatar_valor_alteracao(antes[col].iat[posicao])} → "
+                f"{_formatar_valor_alteracao(atual[col].iat[posicao])}"
+                for col in nomes
+            ))
+        
+        parte = atual[colunas].astype(object)
+        parte.insert(0, 'Tipo de alteração', 'Alterado')
+        parte['Colunas alteradas'] = colunas_alteradas
+        parte['Detalhes'] = detalhes
+        partes.append(parte)
+    
+    if removidos.any():
+        parte = anterior.loc[removidos, colunas].astype(object)
+        parte.insert(0, 'Tipo de alteração', 'Removido')
+        partes.append(parte)
+    
+    colunas_aba = ['Tipo de alteração'] + colunas + ['Colunas alteradas', 'Detalhes']
+    if not partes:
+        return pd.DataFrame(columns=colunas_aba)
+    return pd.concat(partes, ignore_index=True).reindex(columns=colunas_aba)
+
+def comparar_com_snapshot(df, anterior, chaves, hashes):
+    """Compara o relatório com o último processamento da mesma base
+    
+    As linhas são casadas pela chave (Counter, MATERIAL_NO) e o hash do
+    conteúdo separa as inalteradas; só as demais são comparadas coluna a coluna.
+    
+    Retorna (aba de alterações, resumo) ou None quando a comparação não é
+    possível (sem chave, chaves repetidas ou colunas diferentes).
+    """
+    colunas_anteriores = [col for col in anterior.columns if not col.startswith('__')]
+    if chaves is None or colunas_anteriores != list(df.columns):
+        return None
+    
+    indice_atual = pd.Index(chaves)
+    indice_anterior = pd.Index(anterior['__chave'].to_numpy())
+    if not indice_atual.is_unique or not indice_anterior.is_unique:
+        return None
+    
+    posicao_anterior = indice_anterior.get_indexer(indice_atual)
+    existentes = posicao_anterior >= 0
+    novos = ~existentes
+    alterados = existentes.copy()
+    alterados[existentes] = anterior['__hash'].to_numpy()[posicao_anterior[existentes]] != hashes[existentes]
+    removidos = ~indice_anterior.isin(indice_atual)
+    
+    # O hash também muda com o tipo da coluna; só contam as linhas com algum valor diferente
+    if alterados.any():
+        antes = anterior.iloc[posicao_anterior[alterados]]
+        mudou = np.zeros(alterados.sum(), dtype=bool)
+        for col in df.columns:
+            mudou |= _valores_diferentes(df.loc[alterados, col], antes[col])
+        alterados[np.flatnonzero(alterados)[~mudou]] = False
+    
+    df_alteracoes = montar_aba_alteracoes(df, anterior, novos, alterados, removidos, posicao_anterior)
+    
+    resumo = {
+        'novos': int(novos.sum()),
+        'alterados': int(alterados.sum()),
+        'removidos': int(removidos.sum()),
+        'inalterados': int((~(novos | alterados)).sum()),
+    }
+    return df_alteracoes, resumo
+
+def escrever_excel(output, df_dict, regras=None, motor_saida='streaming', perfil=None,
+                   formatacao='celulas'):
+    """Escreve o arquivo Excel formatado com o motor de saída e a formatação escolhidos"""
+    if motor_saida not in MOTORES_SAIDA:
+        raise ValueError(f"Motor de saída desconhecido: {motor_saida}")
+    if formatacao not in FORMATACOES:
+        raise ValueError(f"Formatação desconhecida: {formatacao}")
+    
+    if motor_saida == 'streaming':
+        escrever_excel_streaming(output, df_dict, regras, perfil, formatacao)
+    elif motor_saida == 'paralelo':
+        escrever_excel_paralelo(output, df_dict, regras, perfil, formatacao)
+    else:
+        escrever_excel_openpyxl(output, df_dict, regras, perfil, formatacao)
+
+def escrever_excel_simples(output, df_dict, perfil=None):
+    """Escreve apenas os dados de cada aba, sem cores, fontes, larguras, filtros nem congelamento
+    
+    Somente as datas recebem o formato DD/MM/YYYY, para continuarem sendo datas no Excel.
+    """
+    workbook = Workbook(write_only=True)
+    estilo_data = None
+    
+    for sheet_name, df_aba in df_dict.items():
+        worksheet = workbook.create_sheet(sheet_name)
+        if estilo_data is None:
+            estilo_data = _com_formato_numerico(worksheet, StyleArray(), FORMATO_DATA_EXCEL)
+        with _etapa(perfil, f'escrita: {sheet_name}', len(df_aba), df_aba.size):
+            aba = como_visao(df_aba)
+            if not aba.colunas:
+                continue
+            if sheet_name != 'Overview':
+                worksheet.append(aba.colunas)
+            for valores in _linhas_em_blocos(aba):
+                worksheet.append([
+                    _celula_estilizada(worksheet, valor, estilo_data) if isinstance(valor, datetime) else valor
+                    for valor in valores
+                ])
+    
+    with _etapa(perfil, 'gravação do .xlsx'):
+        workbook.save(output)
+
+def _dados_parquet(df_aba):
+    """Arquivo Parquet da aba; colunas de tipos mistos são gravadas como texto"""
+    dados = como_dataframe(df_aba)
+    if not all(isinstance(col, str) for col in dados.columns):
+        dados = dados.rename(columns=str)
+    
+    buffer = io.BytesIO()
+    try:
+        dados.to_parquet(buffer, index=False)
+    except (TypeError, ValueError):
+        # Mesmo caso do cache de leitura: o pyarrow não aceita colunas object com tipos mistos
+        mistas = [col for col in dados.columns if dados[col].dtype == object]
+        buffer = io.BytesIO()
+        dados.astype({col: 'string' for col in mistas}).to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+def _escrever_csv_aba(destino, df_aba, cabecalho=True):
+    """Escreve a aba como CSV (UTF-8) em blocos de linhas, sem materializar a aba inteira"""
+    aba = como_visao(df_aba)
+    if not aba.colunas:
+        return
+    texto = io.TextIOWrapper(destino, encoding='utf-8', newline='')
+    for inicio in range(0, max(len(aba), 1), TAMANHO_BLOCO_ESCRITA):
+        aba.bloco(inicio, inicio + TAMANHO_BLOCO_ESCRITA).to_csv(
+            texto, index=False, header=cabecalho and inicio == 0
+        )
+    texto.flush()
+    texto.detach()
+
+def escrever_pacote_dados(output, df_dict, formato, perfil=None):
+    """Grava um .zip com um arquivo Parquet ou CSV por aba (a Overview sai sem cabeçalho no CSV)"""
+    if formato == 'parquet' and not CACHE_PARQUET_DISPONIVEL:
+        raise ValueError("O formato Parquet requer o pacote pyarrow")
+    
+    # Parquet já é comprimido; o CSV é comprimido no .zip
+    compressao = zipfile.ZIP_STORED if formato == 'parquet' else zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(output, 'w', compressao) as pacote:
+        for sheet_name, df_aba in df_dict.items():
+            with _etapa(perfil, f'{formato}: {sheet_name}', len(df_aba), df_aba.size):
+                nome = f"{sheet_name}.{formato}"
+                if formato == 'parquet':
+                    pacote.writestr(nome, _dados_parquet(df_aba))
+                else:
+                    with pacote.open(nome, 'w', force_zip64=True) as destino:
+                        _escrever_csv_aba(destino, df_aba, cabecalho=(sheet_name != 'Overview'))
+
+def escrever_saida(output, df_dict, formato_saida='xlsx', regras=None, motor_saida='streaming',
+                   perfil=None, formatacao='celulas'):
+    """Escreve as abas no formato de saída escolhido (motor e formatação valem só para o relatório .xlsx)"""
+    if formato_saida == 'xlsx':
+        escrever_excel(output, df_dict, regras, motor_saida, perfil, formatacao)
+    elif formato_saida == 'xlsx_simples':
+        escrever_excel_simples(output, df_dict, perfil)
+    elif formato_saida in ('parquet', 'csv'):
+        escrever_pacote_dados(output, df_dict, formato_saida, perfil)
+    else:
+        raise ValueError(f"Formato de saída desconhecido: {formato_saida}")
+
+def _blocos_da_planilha(worksheet, tamanho_bloco, colunas=None):
+    """Gera DataFrames de até `tamanho_bloco` linhas a partir de uma aba read_only
+    
+    A primeira linha é o cabeçalho; linhas totalmente vazias são ignoradas.
+    Os tipos são inferidos pelo mesmo parser do read_excel (cada bloco por si).
+    Quando não há linhas de dados, gera um único DataFrame vazio com as colunas.
+    """
+    def montar(bloco):
+        return TextParser([nomes] + bloco, header=0).read()
+    
+    linhas = worksheet.iter_rows(values_only=True)
+    cabecalho = list(next(linhas, ()))
+    
+    # Colunas sem nome no fim do cabeçalho são descartadas, como no read_excel
+    while cabecalho and cabecalho[-1] is None:
+        cabecalho.pop()
+    nomes = [nome if nome is not None else f"Unnamed: {idx}" for idx, nome in enumerate(cabecalho)]
+    posicoes = [idx for idx, nome in enumerate(nomes) if colunas is None or nome in colunas]
+    nomes = [nomes[idx] for idx in posicoes]
+    
+    bloco = []
+    gerou = False
+    for linha in linhas:
+        if all(valor is None for valor in linha):
+            continue
+        # Células vazias chegam ao parser como texto vazio, como no read_excel
+        bloco.append(['' if idx >= len(linha) or linha[idx] is None else linha[idx] for idx in posicoes])
+        if len(bloco) == tamanho_bloco:
+            yield montar(bloco)
+            bloco = []
+            gerou = True
+    
+    if bloco or not gerou:
+        yield montar(bloco)
+
+def _gravar_sequencia(df, caminho, tamanho_lote=TAMANHO_LOTE_INTERCALACAO):
+    """Grava um bloco já ordenado em disco, em lotes que podem ser lidos um a um"""
+    with open(caminho, 'wb') as f:
+        for inicio in range(0, len(df), tamanho_lote):
+            pickle.dump(df.iloc[inicio:inicio + tamanho_lote], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _ler_sequencia(caminho):
+    """Lê de volta, lote a lote, um bloco gravado por _gravar_sequencia"""
+    with open(caminho, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def _intercalar_sequencias(caminhos, coluna_chave=None):
+    """Intercala sequências ordenadas (ordenação externa), lote a lote
+    
+    A chave de cada linha é (coluna_chave, número original da linha), guardado
+    no índice pela 1ª passagem; por isso não há empates e o resultado é o
+    mesmo da ordenação estável do relatório inteiro. A cada passo são
+    emitidas as linhas até a menor das maiores chaves em memória; nenhuma
+    linha posterior de qualquer sequência pode ser menor.
+    Sem `coluna_chave`, as sequências são apenas concatenadas.
+    """
+    if coluna_chave is None or len(caminhos) == 1:
+        for caminho in caminhos:
+            for lote in _ler_sequencia(caminho):
+                yield lote.reset_index(drop=True)
+        return
+    
+    leitores = [_ler_sequencia(caminho) for caminho in caminhos]
+    pendentes = [None] * len(caminhos)
+    
+    def chave(lote):
+        # Counter vazio fica no fim, como no sort_values
+        return lote[coluna_chave].to_numpy(dtype=float, na_value=np.inf)
+    
+    def ate_limite(lote, limite):
+        valores, linhas = chave(lote), lote.index.to_numpy()
+        return (valores < limite[0]) | ((valores == limite[0]) & (linhas <= limite[1]))
+    
+    while True:
+        for idx, leitor in enumerate(leitores):
+            if leitor is not None and (pendentes[idx] is None or pendentes[idx].empty):
+                pendentes[idx] = next(leitor, None)
+                if pendentes[idx] is None:
+                    leitores[idx] = None
+        
+        ativos = [lote for lote in pendentes if lote is not None and not lote.empty]
+        if not ativos:
+            return
+        
+        limite = min((chave(lote)[-1], lote.index[-1]) for lote in ativos)
+        partes = []
+        for idx, lote in enumerate(pendentes):
+            if lote is None or lote.empty:
+                continue
+            emitir = ate_limite(lote, limite)
+            partes.append(lote[emitir])
+            pendentes[idx] = lote[~emitir]
+        
+        saida = pd.concat(partes)
+        yield saida.iloc[np.lexsort((saida.index.to_numpy(), chave(saida)))].reset_index(drop=True)
+
+def _colunas_abas(colunas):
+    """Colunas de cada aba de dados no modo em blocos (vazio quando a aba não existe)"""
+    membros = calcular_membros_abas(pd.DataFrame(columns=colunas)).columns
+    colunas_abas = {'Relatório BI': list(colunas)}
+    for nome_aba, colunas_aba in colunas_das_abas(colunas).items():
+        colunas_abas[nome_aba] = colunas_aba if nome_aba in membros else []
+    return colunas_abas
+
+def _recorte_aba(df, sheet_name, colunas, membros):
+    """Visão das linhas e colunas do bloco que vão para a aba"""
+    if sheet_name == 'Relatório BI':
+        return VisaoAba(df)
+    if not colunas:
+        return VisaoAba(pd.DataFrame())
+    return VisaoAba(df, np.flatnonzero(membros[sheet_name].to_numpy()), colunas)
+
+def processar_em_blocos(uploaded_file, tamanho_bloco=TAMANHO_BLOCO_LEITURA,
+                        somente_colunas_utilizadas=False, progresso=None, perfil=None,
+                        formatacao='celulas'):
+    """Processa o relatório em blocos de linhas, com memória limitada pelo tamanho do bloco
+    
+    1ª passagem: lê a aba em blocos (openpyxl read_only), converte datas,
+    ordena cada bloco por Counter e o grava em disco, acumulando larguras,
+    totais e colunas de data de cada aba.
+    2ª passagem: intercala os blocos ordenados e escreve cada lote nas abas
+    Relatório BI, RM, PO e Stock ao mesmo tempo, acumulando os agregados da
+    Overview, que é escrita por último (mas fica em primeiro no arquivo).
+    
+    Retorna o arquivo e os totais de linhas do Relatório BI, RM, PO e Stock.
+    """
+    conteudo = ler_conteudo_arquivo(uploaded_file)
+    colunas_lidas = set(COLUNAS_UTILIZADAS) if somente_colunas_utilizadas else None
+    hoje = datetime.now()
+    
+    with tempfile.TemporaryDirectory(prefix='plan_app_blocos_') as pasta:
+        # 1ª passagem: leitura, preparação e ordenação de cada bloco
+        sequencias = []
+        colunas_abas = None
+        larguras = {}
+        totais = {}
+        colunas_data = set()
+        
+        with _etapa(perfil, 'leitura e ordenação em blocos') as info:
+            origem = load_workbook(io.BytesIO(conteudo), read_only=True, data_only=True)
+            try:
+                planilha = origem.worksheets[0]
+                total_estimado = max((planilha.max_row or 1) - 1, 1)
+                
+                linhas_lidas = 0
+                formatos_data = {}
+                for bloco in _blocos_da_planilha(planilha, tamanho_bloco, colunas_lidas):
+                    # Número original de cada linha no índice: desempata a intercalação por Counter
+                    bloco.index = pd.RangeIndex(linhas_lidas, linhas_lidas + len(bloco))
+                    linhas_lidas += len(bloco)
+                    bloco = preparar_relatorio(bloco, formatos_data=formatos_data)
+                    membros = calcular_membros_abas(bloco)
+                    
+                    if colunas_abas is None:
+                        colunas_abas = _colunas_abas(bloco.columns)
+                        larguras = {aba: [0] * len(colunas) for aba, colunas in colunas_abas.items()}
+                        totais = dict.fromkeys(colunas_abas, 0)
+                    
+                    colunas_data.update(col for col in bloco.columns
+                                        if pd.api.types.is_datetime64_any_dtype(bloco[col]))
+                    for sheet_name, colunas in colunas_abas.items():
+                        recorte = _recorte_aba(bloco, sheet_name, colunas, membros)
+                        larguras[sheet_name] = list(map(max, larguras[sheet_name],
+                                                        calcular_larguras_colunas(recorte)))
+                        totais[sheet_name] += len(recorte)
+                    
+                    caminho = os.path.join(pasta, f"sequencia_{len(sequencias):05d}.pkl")
+                    _gravar_sequencia(bloco, caminho)
+                    sequencias.append(caminho)
+                    
+                    lidas = totais['Relatório BI']
+                    _informar_progresso(progresso, min(0.5 * lidas / total_estimado, 0.5),
+                                        f"Lendo e ordenando em blocos ({lidas} linhas)")
+            finally:
+                origem.close()
+            
+            info['linhas'] = totais['Relatório BI']
+            info['celulas'] = totais['Relatório BI'] * len(colunas_abas['Relatório BI'])
+        
+        # 2ª passagem: intercalação e escrita de todas as abas em uma única varredura
+        workbook = _criar_workbook_escrita()
+        planilha_overview = workbook.create_sheet('Overview')
+        estilos = criar_estilos_relatorio(planilha_overview)
+        
+        planilhas = {}
+        estilos_abas = {}
+        for sheet_name, colunas in colunas_abas.items():
+            worksheet = workbook.create_sheet(sheet_name)
+            _preparar_aba_dados(worksheet, pd.DataFrame(columns=colunas), larguras[sheet_name],
+                                totais[sheet_name])
+            if colunas:
+                worksheet.append([_celula_estilizada(worksheet, col, estilos['cabecalho'])
+                                  for col in colunas])
+            planilhas[sheet_name] = worksheet
+            eh_data = [col in colunas_data for col in colunas]
+            if formatacao == 'condicional':
+                aplicar_regras_condicionais_excel(worksheet, colunas, totais[sheet_name])
+                estilos_abas[sheet_name] = _estilos_colunas_condicional(estilos, eh_data)
+            else:
+                estilos_abas[sheet_name] = _estilos_colunas(estilos, eh_data)
+        
+        with _etapa(perfil, 'intercalação e escrita em blocos') as info:
+            agregados = None
+            escritas = 0
+            coluna_chave = 'Counter' if 'Counter' in colunas_abas['Relatório BI'] else None
+            
+            for lote in _intercalar_sequencias(sequencias, coluna_chave):
+                regras = calcular_regras_condicionais(lote) if formatacao == 'celulas' else None
+                membros = calcular_membros_abas(lote)
+                
+                for sheet_name, colunas in colunas_abas.items():
+                    if not colunas:
+                        continue
+                    recorte = _recorte_aba(lote, sheet_name, colunas, membros)
+                    if regras is None:
+                        classes = np.zeros(len(recorte), dtype=np.int8)
+                    else:
+                        classes = classificar_linhas(recorte, regras)
+                    _escrever_linhas_dados(planilhas[sheet_name], recorte, estilos_abas[sheet_name], classes)
+                
+                agregados = combinar_agregados_overview(agregados, calcular_agregados_overview(lote, hoje))
+                
+                escritas += len(lote)
+                _informar_progresso(progresso, 0.5 + 0.4 * escritas / max(totais['Relatório BI'], 1),
+                                    f"Gerando e formatando arquivo Excel ({escritas} linhas)")
+            
+            info['linhas'] = escritas
+            info['celulas'] = sum(totais[aba] * len(colunas) for aba, colunas in colunas_abas.items())
+        
+        with _etapa(perfil, 'overview'):
+            if agregados is None:
+                agregados = calcular_agregados_overview(pd.DataFrame(columns=colunas_abas['Relatório BI']), hoje)
+            _escrever_aba_overview_streaming(planilha_overview, criar_aba_overview(agregados=agregados), estilos)
+        
+        output = io.BytesIO()
+        with _etapa(perfil, 'gravação do .xlsx'):
+            workbook.save(output)
+    
+    output.seek(0)
+    return output, totais['Relatório BI'], totais['RM'], totais['PO'], totais['Stock']
+
+def _informar_progresso(progresso, fracao, mensagem):
+    """Repassa o andamento do processamento para o callback, se houver"""
+    if progresso is not None:
+        progresso(fracao, mensagem)
+
+def processar_arquivo(uploaded_file, motor_saida='streaming', somente_colunas_utilizadas=False,
+                      progresso=None, captura_perfil=None, base_incremental=None,
+                      tamanho_bloco_leitura=None, formatacao='celulas', formato_saida='xlsx',
+                      usar_cache_leitura=True):
+    """Função principal para processar o arquivo
+    
+    Com `somente_colunas_utilizadas`, apenas as colunas usadas pelas abas RM,
+    PO, Stock e Overview são lidas, e o Relatório BI sai reduzido a elas.
+    `progresso`, quando informado, é chamado como progresso(fracao, mensagem)
+    ao início de cada etapa. `captura_perfil` ('cprofile' ou 'pyinstrument')
+    anexa ao perfil uma captura detalhada do processamento. Sem
+    `usar_cache_leitura`, o arquivo é sempre lido do .xlsx (sem o cache Parquet).
+    
+    Com `base_incremental` (nome livre que identifica o relatório, por exemplo
+    o projeto), o arquivo ganha um relatório das alterações desde o último
+    processamento da mesma base: a aba de alterações, com as linhas novas,
+    alteradas e removidas. É um relatório a mais, não um atalho: o
+    processamento é o completo, acrescido da comparação e da gravação deste
+    processamento para a próxima. O resumo fica em `perfil.incremental`.
+    
+    Com `tamanho_bloco_leitura`, o relatório é processado em blocos dessa
+    quantidade de linhas (processar_em_blocos), para arquivos que não cabem
+    inteiros na memória; esse modo escreve sempre com o motor em streaming.
+    
+    `formatacao` ('celulas' ou 'condicional') define se as cores das linhas são
+    pintadas célula a célula ou gravadas como formatação condicional do Excel.
+    
+    `formato_saida` é um de FORMATOS_SAIDA ou uma lista deles; os formatos são
+    gerados a partir do mesmo processamento e apenas os pedidos são gerados.
+    Com uma lista, o arquivo retornado é um dict formato -> arquivo.
+    
+    Retorna o arquivo, os totais de linhas de cada aba e o PerfilProcessamento.
+    """
+    formatos = [formato_saida] if isinstance(formato_saida, str) else list(formato_saida)
+    desconhecidos = [formato for formato in formatos if formato not in FORMATOS_SAIDA]
+    if desconhecidos or not formatos:
+        raise ValueError(f"Formato de saída desconhecido: {', '.join(desconhecidos)}")
+    if 'parquet' in formatos and not CACHE_PARQUET_DISPONIVEL:
+        raise ValueError("O formato Parquet requer o pacote pyarrow")
+    
+    if tamanho_bloco_leitura is not None:
+        if formatos != ['xlsx']:
+            raise ValueError("O processamento em blocos gera apenas o relatório formatado (.xlsx)")
+        if base_incremental is not None:
+            raise ValueError("O relatório de alterações não está disponível no processamento em blocos")
+        if motor_saida != 'streaming':
+            raise ValueError("O processamento em blocos escreve apenas com o motor 'streaming'")
+    
+    perfil = PerfilProcessamento(captura_perfil)
+    perfil.iniciar()
     
     try:
+        if tamanho_bloco_leitura is not None:
+            output, *totais = processar_em_blocos(uploaded_file, tamanho_bloco_leitura,
+                                                  somente_colunas_utilizadas, progresso, perfil, formatacao)
+            _informar_progresso(progresso, 1.0, "Concluído")
+            saida = output if isinstance(formato_saida, str) else {'xlsx': output}
+            return (saida, *totais, perfil)
+        
         # Carregar o arquivo
-        df = pd.read_excel(uploaded_file)
+        _informar_progresso(progresso, 0.0, "Lendo arquivo")
+        colunas = COLUNAS_UTILIZADAS if somente_colunas_utilizadas else None
+        df = ler_relatorio(uploaded_file, colunas=colunas, usar_cache=usar_cache_leitura, perfil=perfil)
         
-        # Converter colunas de data
-        for col in colunas_data_especificas:
-            if col in df.columns:
-                try:
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-                    df[col] = df[col].dt.strftime('%d/%m/%Y')
-                except:
-                    pass
+        # Converter colunas de data e ordenar por Counter
+        _informar_progresso(progresso, 0.3, "Convertendo datas e ordenando")
+        df = preparar_relatorio(df, perfil)
         
-        # Ordenar por Counter se existir
-        if 'Counter' in df.columns:
-            df['Counter'] = pd.to_numeric(df['Counter'], errors='coerce')
-            df = df.sort_values(by='Counter', ascending=True)
-        
-        # Criar aba RM
-        colunas_rm = [
-            "RESPONSIBLE", "Escopo", "Equipment", "Prazo", "Status", "XP_STATUS",
-            "MATERIAL_NO", "MATERIAL_DESCRIPTION", "STATUS_STYPE", "PRREQRELSTAT",
-            "PO", "DOC PGR", "BUYER_NAME", "OPENING_DATE", "Float(Today-Opening)", "DELIVERY_DATE",
-            "SUPPLY_DATE", "REQUIRED_DATE", "FLOAT", "PLANNED_DELIVERY_TIME_MM",
-            "IN_HOUSE_PROD_TIME", "GRP_TIME_MM", "WBS", "EXCEPTION_MESSAGE", "Comentários SAP Planner"
-        ]
-        
-        colunas_disponiveis_rm = [col for col in colunas_rm if col in df.columns]
-        df_rm = pd.DataFrame()
-        if 'STATUS_STYPE' in df.columns:
-            df_rm = df[df['STATUS_STYPE'] == 'PurRequist'][colunas_disponiveis_rm].copy()
-        
-        # Criar aba PO
-        colunas_po = [
-            "RESPONSIBLE", "Escopo", "Equipment", "Prazo", "Status", "XP_STATUS",
-            "MATERIAL_NO", "MATERIAL_DESCRIPTION", "STATUS_STYPE", "PO", "DOC PGR", "BUYER_NAME", 
-            "DELIVERY_DATE", "SUPPLY_DATE", "REQUIRED_DATE", "FLOAT", "VENDOR_NAME", "WBS", 
-            "EXCEPTION_MESSAGE", "Comentários SAP Planner", "Comentario LogPlan"
-        ]
-        
-        colunas_disponiveis_po = [col for col in colunas_po if col in df.columns]
-        df_po = pd.DataFrame()
-        if 'STATUS_STYPE' in df.columns:
-            df_po = df[df['STATUS_STYPE'].isin(['POConfirm', 'POCreated'])][colunas_disponiveis_po].copy()
-
-        # Criar aba Stock
-        colunas_stock = [
-            "RESPONSIBLE", "Equipment", "Prazo", "Status", "XP_STATUS",
-            "DEMAND", "MATERIAL_NO", "MATERIAL_DESCRIPTION", "STATUS_STYPE",
-            "PO", "REQUIRED_DATE", "WBS", "EXCEPTION_MESSAGE", "QN_NUMBER", 
-            "QN_COORDINATOR", "TYPE_310_", "TYPE_321_", "TYPE_999_", "ECN1", 
-            "ABRG_", "Comentários SAP Planner"
-        ]
-        
-        colunas_disponiveis_stock = [col for col in colunas_stock if col in df.columns]
-        df_stock = pd.DataFrame()
-        if 'Status' in df.columns:
-            df_stock = df[df['Status'] == 'In Stock'][colunas_disponiveis_stock].copy()
+        # Comparar com o último processamento da mesma base
+        df_alteracoes = None
+        if base_incremental is not None:
+            _informar_progresso(progresso, 0.35, "Comparando com o último processamento")
+            with _etapa(perfil, 'comparação com o último processamento', linhas=len(df)):
+                chaves, hashes = calcular_chaves_linhas(df)
+                anterior = carregar_snapshot(base_incremental)
+                comparacao = None
+                if anterior is not None:
+                    comparacao = comparar_com_snapshot(df, anterior, chaves, hashes)
+                del anterior
+            
+            if comparacao is not None:
+                df_alteracoes, perfil.incremental = comparacao
+            else:
+                perfil.incremental = {'sem_comparacao': True}
+        
+        # Criar abas RM, PO e Stock
+        _informar_progresso(progresso, 0.4, "Montando abas RM, PO e Stock")
+        abas = montar_abas(df, perfil)
 
         # Criar aba Overview
-        df_overview = criar_aba_overview(df)
+        _informar_progresso(progresso, 0.5, "Criando Overview")
+        with _etapa(perfil, 'overview', linhas=len(df)):
+            df_overview = criar_aba_overview(df)
         
         # Criar arquivo Excel em memória
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Salvar as abas na ordem desejada
-            df_overview.to_excel(writer, sheet_name='Overview', index=False, header=False)
-            df.to_excel(writer, sheet_name='Relatório BI', index=False)
-            df_rm.to_excel(writer, sheet_name='RM', index=False)
-            df_po.to_excel(writer, sheet_name='PO', index=False)
-            df_stock.to_excel(writer, sheet_name='Stock', index=False)
-            
-            # Aplicar formatação
-            df_dict = {
-                'Overview': df_overview,
-                'Relatório BI': df,
-                'RM': df_rm,
-                'PO': df_po,
-                'Stock': df_stock
-            }
-            aplicar_formato_excel(writer, df_dict)
-            
-            # Formatação básica (filtros e congelamento)
-            for sheet_name in writer.sheets:
-                worksheet = writer.sheets[sheet_name]
-                if sheet_name != 'Overview':  # Não aplicar filtro na Overview
-                    worksheet.auto_filter.ref = worksheet.dimensions
-                    worksheet.freeze_panes = 'A2'
+        df_dict = {
+            'Overview': df_overview,
+            'Relatório BI': VisaoAba(df),
+            **abas
+        }
+        if df_alteracoes is not None:
+            df_dict[ABA_ALTERACOES] = df_alteracoes
+        
+        # Regras de cor avaliadas uma única vez e reaproveitadas por RM, PO e Stock
+        # (desnecessárias quando as cores ficam a cargo da formatação condicional do Excel
+        # ou quando o relatório formatado não foi pedido)
+        regras = None
+        if formatacao == 'celulas' and 'xlsx' in formatos:
+            with _etapa(perfil, 'regras de cor', linhas=len(df)):
+                regras = calcular_regras_condicionais(df)
+        
+        saidas = {}
+        for indice, formato in enumerate(formatos):
+            _informar_progresso(progresso, 0.6 + 0.4 * indice / len(formatos), f"Gerando arquivo ({formato})")
+            saidas[formato] = io.BytesIO()
+            escrever_saida(saidas[formato], df_dict, formato, regras, motor_saida, perfil, formatacao)
+            saidas[formato].seek(0)
         
-        output.seek(0)
-        return output, len(df), len(df_rm), len(df_po), len(df_stock)
+        # Guardar este processamento para a próxima comparação
+        if base_incremental is not None:
+            with _etapa(perfil, 'gravação do último processamento', linhas=len(df)):
+                salvar_snapshot(base_incremental, df, chaves, hashes)
+        
+        _informar_progresso(progresso, 1.0, "Concluído")
+        output = saidas[formato_saida] if isinstance(formato_saida, str) else saidas
+        return output, len(df), len(abas['RM']), len(abas['PO']), len(abas['Stock']), perfil
         
     except Exception as e:
-        raise Exception(f"Erro no processamento: {str(e)}")
\ No newline at end of file
+        etapa = f" na etapa '{perfil.etapa_atual}'" if perfil.etapa_atual else ""
+        raise Exception(f"Erro no processamento{etapa}: {str(e)}") from e
+    
+    finally:
+        perfil.finalizar()
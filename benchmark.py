@@ -0,0 +1,233 @@
+"""Benchmark do processamento do relatório de planejamento
+
+Gera relatórios do BI sintéticos (mesmo conjunto de colunas do export real)
+e mede cada etapa registrada pelo perfil de desempenho do backend
+(processar_arquivo), além do pico de memória (RSS) de cada execução.
+
+Exemplos:
+    python benchmark.py --linhas 1000 10000 --saida resultados.json
+    python benchmark.py --saida atual.json --baseline resultados.json
+"""
+import os
+import json
+import argparse
+import platform
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+import backend
+
+TAMANHOS_PADRAO = [1_000, 10_000, 100_000, 500_000]
+DIRETORIO_PADRAO = os.path.join(backend.DIRETORIO_CACHE, 'benchmark')
+
+# Distribuições aproximadas do export real
+MIX_STATUS_STYPE = {'PurRequist': 0.25, 'POConfirm': 0.30, 'POCreated': 0.20, 'Stock': 0.15, 'Reservation': 0.10}
+MIX_STATUS = {'In Stock': 0.30, 'Open': 0.45, 'Late': 0.25}
+MIX_PREFIXO_DEMAND = {'R': 0.20, 'S': 0.35, 'P': 0.35, '': 0.10}
+
+def _escolher(gerador, mix, linhas):
+    """Sorteia valores de acordo com as proporções do dicionário"""
+    return gerador.choice(list(mix), size=linhas, p=list(mix.values()))
+
+def gerar_relatorio_sintetico(linhas, semente=0):
+    """Gera um DataFrame com o formato do relatório exportado do BI"""
+    gerador = np.random.default_rng(semente)
+    hoje = pd.Timestamp.now().normalize()
+
+    def datas(inicio, fim):
+        valores = hoje + pd.to_timedelta(gerador.integers(inicio, fim, linhas), unit='D')
+        # ~5% das datas em branco
+        return pd.Series(valores).where(gerador.random(linhas) > 0.05)
+
+    prefixos = _escolher(gerador, MIX_PREFIXO_DEMAND, linhas)
+    numeros_demand = gerador.integers(100000, 999999, linhas).astype(str)
+    demand = np.where(prefixos == '', None, np.char.add(prefixos.astype(str), numeros_demand))
+
+    df = pd.DataFrame({
+        'Counter': gerador.permutation(linhas) + 1,
+        'RESPONSIBLE': gerador.choice(['ANA SILVA', 'BRUNO COSTA', 'CARLA SOUZA', 'DIEGO LIMA'], linhas),
+        'Escopo': gerador.choice(['Mecânica', 'Elétrica', 'Automação'], linhas),
+        'Equipment': gerador.choice([f'EQ-{n:03d}' for n in range(1, 41)], linhas),
+        'Prazo': gerador.choice(['No prazo', 'Atrasado', 'Crítico'], linhas),
+        'Status': _escolher(gerador, MIX_STATUS, linhas),
+        'XP_STATUS': gerador.choice(['XP1', 'XP2', 'XP3'], linhas),
+        'DEMAND': demand,
+        'MATERIAL_NO': gerador.integers(10_000_000, 99_999_999, linhas).astype(str),
+        'MATERIAL_DESCRIPTION': [f'COMPONENTE {n} - CONJUNTO {n % 97}' for n in gerador.integers(1, 50_000, linhas)],
+        'STATUS_STYPE': _escolher(gerador, MIX_STATUS_STYPE, linhas),
+        'PRREQRELSTAT': gerador.choice(['Released', 'Blocked', None], linhas),
+        'PROCUREMENT_KEY': gerador.choice(['E', 'F', 'X'], linhas, p=[0.2, 0.7, 0.1]),
+        'PO': gerador.integers(4_500_000_000, 4_599_999_999, linhas),
+        'DOC PGR': gerador.choice(['PGR-A', 'PGR-B', None], linhas),
+        'BUYER_NAME': gerador.choice(['COMPRADOR 1', 'COMPRADOR 2', 'COMPRADOR 3'], linhas),
+        'VENDOR_NAME': gerador.choice([f'FORNECEDOR {n}' for n in range(1, 200)], linhas),
+        'Data de necessidade': datas(-60, 240),
+        'Sup Date or Log Date': datas(-60, 240),
+        'OPENING_DATE': datas(-120, 180),
+        'Opening_Calculada': datas(-120, 180),
+        'PURCHASING_DOC_DATE': datas(-300, 0),
+        'DELIVERY_DATE': datas(-30, 300),
+        'SUPPLY_DATE': datas(-30, 300),
+        'REQUIRED_DATE': datas(0, 360),
+        'Data_Atual': hoje,
+        'Float(Today-Opening)': np.round(gerador.normal(20, 40, linhas), 1),
+        'FLOAT': gerador.integers(-100, 200, linhas),
+        'PLANNED_DELIVERY_TIME_MM': gerador.integers(1, 12, linhas),
+        'IN_HOUSE_PROD_TIME': gerador.integers(0, 60, linhas),
+        'GRP_TIME_MM': gerador.integers(0, 6, linhas),
+        'WBS': gerador.choice([f'P-{n:04d}.01.{m:02d}' for n in range(5) for m in range(20)], linhas),
+        'EXCEPTION_MESSAGE': gerador.choice(['10', '15', '20', None], linhas),
+        'QN_NUMBER': gerador.choice(['', '20001234', '20005678'], linhas),
+        'QN_COORDINATOR': gerador.choice(['', 'COORD A', 'COORD B'], linhas),
+        'TYPE_310_': gerador.integers(0, 3, linhas),
+        'TYPE_321_': gerador.integers(0, 3, linhas),
+        'TYPE_999_': gerador.integers(0, 3, linhas),
+        'ECN1': gerador.choice(['', 'ECN-01', 'ECN-02'], linhas),
+        'ABRG_': gerador.choice(['', 'A', 'B'], linhas),
+        'Comentários SAP Planner': gerador.choice([None, 'Aguardando fornecedor', 'Verificar com compras'], linhas),
+        'Comentario LogPlan': gerador.choice([None, 'OK', 'Pendente'], linhas),
+    })
+    return df
+
+def salvar_relatorio_sintetico(df, caminho):
+    """Salva o DataFrame como .xlsx sem formatação (write_only, rápido e com pouca memória)"""
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Sheet1')
+    worksheet.append(list(df.columns))
+    for inicio in range(0, len(df), backend.TAMANHO_BLOCO_ESCRITA):
+        bloco = df.iloc[inicio:inicio + backend.TAMANHO_BLOCO_ESCRITA].astype(object)
+        bloco = bloco.where(bloco.notna(), None)
+        for valores in bloco.itertuples(index=False, name=None):
+            worksheet.append(valores)
+    workbook.save(caminho)
+
+def obter_relatorio_sintetico(linhas, diretorio=DIRETORIO_PADRAO, semente=0):
+    """Retorna o caminho do .xlsx sintético, gerando-o apenas se ainda não existir"""
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = os.path.join(diretorio, f'relatorio_bi_{linhas}_{semente}.xlsx')
+    if not os.path.exists(caminho):
+        salvar_relatorio_sintetico(gerar_relatorio_sintetico(linhas, semente), caminho)
+    return caminho
+
+def medir_etapas(caminho, motor_saida='streaming', usar_cache=False):
+    """Processa o arquivo com backend.processar_arquivo e retorna o tempo de cada etapa do perfil
+
+    Etapas com o mesmo nome (por exemplo, a gravação de cada formato) são somadas;
+    o total é o tempo do processamento inteiro medido pelo PerfilProcessamento.
+    """
+    output, total_bi, *_, perfil = backend.processar_arquivo(
+        caminho, motor_saida=motor_saida, usar_cache_leitura=usar_cache
+    )
+
+    dados_perfil = perfil.como_dict()
+    etapas = {}
+    for etapa in dados_perfil['etapas']:
+        etapas[etapa['etapa']] = etapas.get(etapa['etapa'], 0.0) + etapa['segundos']
+
+    return {
+        'linhas': total_bi,
+        'motor_saida': motor_saida,
+        'etapas': etapas,
+        'total': dados_perfil['total_segundos'],
+        'tamanho_arquivo_mb': output.getbuffer().nbytes / (1024 * 1024),
+        'pico_rss_mb': dados_perfil['pico_memoria_mb'],
+    }
+
+def _executar_isolado(caminho, motor_saida, usar_cache, fila):
+    """Mede uma execução em um processo novo, sem a memória nem os caches das anteriores"""
+    try:
+        fila.put(medir_etapas(caminho, motor_saida, usar_cache))
+    except Exception as e:
+        fila.put({'erro': str(e)})
+
+def executar_benchmark(tamanhos=TAMANHOS_PADRAO, motores=('streaming',), diretorio=DIRETORIO_PADRAO,
+                       usar_cache=False, semente=0):
+    """Executa o benchmark para cada tamanho e motor e retorna o resultado completo"""
+    contexto = multiprocessing.get_context('spawn')
+    resultados = []
+
+    for linhas in tamanhos:
+        caminho = obter_relatorio_sintetico(linhas, diretorio, semente)
+        for motor_saida in motores:
+            fila = contexto.Queue()
+            processo = contexto.Process(target=_executar_isolado,
+                                        args=(caminho, motor_saida, usar_cache, fila))
+            processo.start()
+            resultado = fila.get()
+            processo.join()
+
+            resultado.setdefault('linhas', linhas)
+            resultado.setdefault('motor_saida', motor_saida)
+            resultados.append(resultado)
+            _imprimir_resultado(resultado)
+
+    return {
+        'executado_em': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'versao_regras': backend.VERSAO_REGRAS,
+        'resultados': resultados,
+    }
+
+def _imprimir_resultado(resultado):
+    """Imprime uma linha de resumo de uma execução"""
+    if 'erro' in resultado:
+        print(f"{resultado['linhas']:>8} linhas [{resultado['motor_saida']}] ERRO: {resultado['erro']}")
+        return
+    etapas = ' '.join(f"{nome}={tempo:.2f}s" for nome, tempo in resultado['etapas'].items())
+    pico = f"{resultado['pico_rss_mb']:.0f}MB" if resultado['pico_rss_mb'] is not None else "?"
+    print(f"{resultado['linhas']:>8} linhas [{resultado['motor_saida']}] total={resultado['total']:.2f}s "
+          f"pico={pico} | {etapas}")
+
+def comparar_com_baseline(atual, baseline):
+    """Imprime a variação de cada etapa em relação a uma execução anterior"""
+    anteriores = {
+        (r['linhas'], r['motor_saida']): r for r in baseline['resultados'] if 'erro' not in r
+    }
+    print("\nComparação com baseline (atual / baseline):")
+    for resultado in atual['resultados']:
+        anterior = anteriores.get((resultado['linhas'], resultado['motor_saida']))
+        if anterior is None or 'erro' in resultado:
+            continue
+        variacoes = [
+            f"{nome}={tempo / anterior['etapas'][nome]:.2f}x"
+            for nome, tempo in resultado['etapas'].items()
+            if anterior['etapas'].get(nome)
+        ]
+        pico = "?"
+        if resultado['pico_rss_mb'] and anterior.get('pico_rss_mb'):
+            pico = f"{resultado['pico_rss_mb'] / anterior['pico_rss_mb']:.2f}x"
+        print(f"{resultado['linhas']:>8} linhas [{resultado['motor_saida']}] "
+              f"total={resultado['total'] / anterior['total']:.2f}x pico={pico} | {' '.join(variacoes)}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do processamento do relatório de planejamento")
+    parser.add_argument('--linhas', type=int, nargs='+', default=TAMANHOS_PADRAO,
+                        help="Tamanhos dos relatórios sintéticos (padrão: 1k 10k 100k 500k)")
+    parser.add_argument('--motor', nargs='+', default=['streaming'], choices=backend.MOTORES_SAIDA,
+                        help="Motores de saída a medir")
+    parser.add_argument('--diretorio', default=DIRETORIO_PADRAO,
+                        help="Onde guardar os relatórios sintéticos gerados")
+    parser.add_argument('--cache-leitura', action='store_true',
+                        help="Usar o cache Parquet na leitura (mede a releitura de um arquivo conhecido)")
+    parser.add_argument('--saida', help="Arquivo JSON onde salvar os resultados")
+    parser.add_argument('--baseline', help="Arquivo JSON de uma execução anterior para comparação")
+    args = parser.parse_args(argv)
+
+    resultado = executar_benchmark(args.linhas, args.motor, args.diretorio, args.cache_leitura)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            comparar_com_baseline(resultado, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,29 @@
+import time
+import json
+import pandas as pd
 import streamlit as st
 from datetime import datetime
-from backend import processar_arquivo
+from jobs import enviar_job, status_job, NA_FILA, PROCESSANDO, ERRO
+from backend import (registrar_perfil_json, ARQUIVO_LOG_DESEMPENHO, TAMANHO_BLOCO_LEITURA,
+                     ler_esquema_relatorio, validar_esquema, estimar_processamento,
+                     FORMATOS_SAIDA, SUFIXOS_FORMATOS_SAIDA)
+
+# Intervalo entre as consultas ao andamento do processamento
+INTERVALO_CONSULTA_SEGUNDOS = 1
+
+# Formatos de saída oferecidos: rótulo e tipo MIME de cada um
+FORMATOS_DOWNLOAD = {
+    "xlsx": ("📥 BAIXAR ARQUIVO FORMATADO", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "xlsx_simples": ("📄 Baixar .xlsx só com os dados", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": ("🗜️ Baixar dados em Parquet (.zip)", "application/zip"),
+    "csv": ("🗜️ Baixar dados em CSV (.zip)", "application/zip"),
+}
+NOMES_FORMATOS = {
+    "xlsx": "Relatório formatado (.xlsx)",
+    "xlsx_simples": "Somente dados, sem formatação (.xlsx)",
+    "parquet": "Parquet por aba (.zip)",
+    "csv": "CSV por aba (.zip)",
+}
 
 # Configurar a página
 st.set_page_config(
@@ -44,37 +67,189 @@ uploaded_file = st.file_uploader("Carregue seu arquivo Excel", type=["xlsx", "xl
 if uploaded_file is not None:
     st.success(f"✅ Arquivo carregado: {uploaded_file.name}")
     
+    # Relatório de alterações desde o último processamento da mesma base (aba Alterações)
+    base_incremental = None
+    if st.checkbox("🔁 Incluir as alterações desde o último processamento",
+                   help="Acrescenta a aba Alterações; o processamento fica um pouco mais demorado"):
+        base_incremental = st.text_input(
+            "Nome da base (projeto)", value="Rotina de planejamento",
+            help="Arquivos da mesma base são comparados entre si pelas colunas Counter e MATERIAL_NO"
+        ).strip() or None
+    
+    # Arquivos muito grandes: leitura e escrita em blocos, com memória limitada
+    tamanho_bloco_leitura = None
+    if st.checkbox("📦 Arquivo muito grande (processar em blocos, usando menos memória)",
+                   disabled=base_incremental is not None,
+                   help="Não pode ser combinado com o relatório de alterações"):
+        tamanho_bloco_leitura = TAMANHO_BLOCO_LEITURA
+    
+    # Cores como regras do Excel: arquivo menor e cores que acompanham edições posteriores
+    formatacao = "condicional" if st.checkbox(
+        "🧮 Cores como formatação condicional do Excel (arquivo menor)",
+        help="As cores passam a ser regras do Excel e se atualizam quando os valores são editados"
+    ) else "celulas"
+    
+    # Apenas os formatos escolhidos são gerados (os de dados ficam prontos bem mais rápido)
+    formatos_saida = st.multiselect(
+        "📦 Formatos de saída", FORMATOS_SAIDA, default=["xlsx"],
+        format_func=NOMES_FORMATOS.get,
+        disabled=tamanho_bloco_leitura is not None,
+        help="Parquet e CSV geram um .zip com um arquivo por aba, para o Power BI e scripts"
+    )
+    if tamanho_bloco_leitura is not None:
+        formatos_saida = ["xlsx"]
+    
+    # Leitura apenas das colunas usadas pelas abas e pela Overview (mais rápida; Relatório BI reduzido)
+    somente_colunas_utilizadas = st.checkbox(
+        "✂️ Ler apenas as colunas utilizadas (mais rápido)",
+        help="O Relatório BI sai só com as colunas usadas pelas abas RM, PO, Stock e pela Overview"
+    )
+    
+    # Captura detalhada opcional (deixa o processamento mais lento)
+    captura_perfil = "cprofile" if st.checkbox("⏱️ Capturar perfil detalhado (cProfile)") else None
+    
+    # Verificação rápida (apenas cabeçalho e dimensões), feita uma vez por arquivo carregado
+    chave_verificacao = (uploaded_file.name, uploaded_file.size)
+    if st.session_state.get("verificacao_chave") != chave_verificacao:
+        try:
+            esquema = ler_esquema_relatorio(uploaded_file.getvalue())
+            st.session_state["verificacao"] = (esquema, validar_esquema(esquema["colunas"]))
+        except Exception as e:
+            st.session_state["verificacao"] = (None, {"valido": False, "conhecido": False, "avisos": [],
+                                                      "erros": [f"Não foi possível ler o cabeçalho: {e}"]})
+        st.session_state["verificacao_chave"] = chave_verificacao
+    esquema, validacao = st.session_state["verificacao"]
+    
+    if validacao["valido"]:
+        origem = "formato já conhecido" if validacao["conhecido"] else "todas as colunas necessárias encontradas"
+        st.success(f"🔎 Cabeçalho verificado: {origem}")
+    else:
+        st.error("🔎 Este arquivo não parece ser o relatório do BI esperado:\n\n"
+                 + "\n".join(f"- {erro}" for erro in validacao["erros"]))
+    if validacao["avisos"]:
+        with st.expander("⚠️ Colunas ausentes nas abas"):
+            st.markdown("\n".join(f"- {aviso}" for aviso in validacao["avisos"]))
+    
+    # Estimativa de tempo e memória pelo número de células
+    if esquema is not None:
+        estimativa = estimar_processamento(esquema["linhas"], len(esquema["colunas"]), tamanho_bloco_leitura)
+        col1, col2, col3 = st.columns(3)
+        aproximado = "~" if esquema["linhas_estimadas"] else ""
+        col1.metric("Linhas", f"{aproximado}{esquema['linhas']}" if esquema["linhas"] is not None else "—")
+        if estimativa is not None:
+            col2.metric("Tempo estimado", f"~{estimativa['segundos']:.0f} s")
+            col3.metric("Memória estimada", f"~{estimativa['memoria_mb']:.0f} MB")
+    
+    # Arquivos reprovados na verificação só são processados com confirmação
+    processar_mesmo_assim = validacao["valido"] or st.checkbox("Processar mesmo assim")
+    
     # Botão de processar em cinza (secondary)
-    if st.button("🎨 PROCESSAR E FORMATAR ARQUIVO", type="secondary"):
-        with st.spinner("Processando e formatando arquivo... Aguarde"):
-            try:
-                output, total_bi, total_rm, total_po, total_stock = processar_arquivo(uploaded_file)
-                
-                st.success("✅ Processamento e formatação concluídos com sucesso!")
-                
-                # Botão de download em verde (primary)
-                data_hoje = datetime.now().strftime("%Y%m%d")
-                nome_arquivo = f"{data_hoje} - Rotina de planejamento.xlsx"
-                
-                st.download_button(
-                    label="📥 BAIXAR ARQUIVO FORMATADO",
-                    data=output,
-                    file_name=nome_arquivo,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    type="primary"  # Verde
-                )
-                
-                # Resumo
-                st.subheader("📋 Resumo do Processamento")
-                col1, col2, col3, col4, col5 = st.columns(5)
-                col1.metric("Overview", "Análises")
-                col2.metric("Relatório BI", f"{total_bi} linhas")
-                col3.metric("Aba RM", f"{total_rm} linhas")
-                col4.metric("Aba PO", f"{total_po} linhas")
-                col5.metric("Aba Stock", f"{total_stock} linhas")
-                
-            except Exception as e:
-                st.error(f"❌ Erro: {str(e)}")
+    if st.button("🎨 PROCESSAR E FORMATAR ARQUIVO", type="secondary",
+                 disabled=not processar_mesmo_assim or not formatos_saida):
+        try:
+            # O processamento roda em segundo plano; a página apenas acompanha o job
+            st.session_state["job_id"] = enviar_job(uploaded_file.getvalue(), captura_perfil,
+                                                  base_incremental, tamanho_bloco_leitura,
+                                                  formatacao, formatos_saida, somente_colunas_utilizadas)
+            st.session_state["job_arquivo"] = uploaded_file.name
+        except Exception as e:
+            st.error(f"❌ Erro: {str(e)}")
+    
+    # Acompanhar apenas o job do arquivo carregado atualmente
+    job_id = st.session_state.get("job_id")
+    if st.session_state.get("job_arquivo") != uploaded_file.name:
+        job_id = None
+    job = status_job(job_id) if job_id else None
+    
+    if job is None:
+        st.session_state.pop("job_id", None)
+    elif job["estado"] in (NA_FILA, PROCESSANDO):
+        if job["estado"] == NA_FILA:
+            st.info(f"⏳ Arquivo na fila de processamento - posição {job['posicao']}")
+        st.progress(job["progresso"], text=f"Processando e formatando arquivo... {job['mensagem']}")
+        
+        # Consultar novamente até o arquivo ficar pronto
+        time.sleep(INTERVALO_CONSULTA_SEGUNDOS)
+        st.rerun()
+    elif job["estado"] == ERRO:
+        st.error(f"❌ Erro: {job['erro']}")
+        st.session_state.pop("job_id", None)
+    else:
+        arquivos, total_bi, total_rm, total_po, total_stock, perfil = job["resultado"]
+        
+        st.success("✅ Processamento e formatação concluídos com sucesso!")
+        
+        # Um botão de download por formato gerado; o relatório formatado em verde (primary)
+        data_hoje = datetime.now().strftime("%Y%m%d")
+        colunas_download = st.columns(len(arquivos))
+        for coluna, (formato, conteudo) in zip(colunas_download, arquivos.items()):
+            rotulo, mime = FORMATOS_DOWNLOAD[formato]
+            coluna.download_button(
+                label=rotulo,
+                data=conteudo,
+                file_name=f"{data_hoje} - Rotina de planejamento{SUFIXOS_FORMATOS_SAIDA[formato]}",
+                mime=mime,
+                type="primary" if formato == "xlsx" else "secondary"
+            )
+        
+        # Resumo
+        st.subheader("📋 Resumo do Processamento")
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("Overview", "Análises")
+        col2.metric("Relatório BI", f"{total_bi} linhas")
+        col3.metric("Aba RM", f"{total_rm} linhas")
+        col4.metric("Aba PO", f"{total_po} linhas")
+        col5.metric("Aba Stock", f"{total_stock} linhas")
+        
+        # Alterações em relação ao último processamento da base
+        incremental = perfil["incremental"]
+        if incremental is not None:
+            if incremental.get("sem_comparacao"):
+                st.info("🔁 Sem processamento anterior comparável: o arquivo foi gerado sem a aba de alterações.")
+            else:
+                st.subheader("🔁 Alterações desde o último processamento")
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("Novas", incremental["novos"])
+                col2.metric("Alteradas", incremental["alterados"])
+                col3.metric("Removidas", incremental["removidos"])
+                col4.metric("Inalteradas", incremental["inalterados"])
+        
+        # Desempenho de cada etapa do processamento
+        with st.expander("⏱️ Desempenho"):
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Tempo total", f"{perfil['total_segundos']:.2f} s")
+            col2.metric("Etapas", len(perfil["etapas"]))
+            if perfil["pico_memoria_mb"] is not None:
+                if perfil["escopo_pico_memoria"] == "processo":
+                    col3.metric("Pico de memória (processo, desde o início)", f"{perfil['pico_memoria_mb']:.0f} MB")
+                else:
+                    col3.metric("Pico de memória", f"{perfil['pico_memoria_mb']:.0f} MB",
+                                delta=f"{perfil['pico_memoria_mb'] - perfil['memoria_inicial_mb']:+.0f} MB no processamento",
+                                delta_color="off")
+            
+            etapas = pd.DataFrame(perfil["etapas"]).rename(columns={
+                "etapa": "Etapa",
+                "segundos": "Tempo (s)",
+                "linhas": "Linhas",
+                "celulas": "Células",
+                "memoria_mb": "Memória (MB)",
+                "pico_memoria_mb": "Pico de memória (MB)",
+            })
+            st.dataframe(etapas, hide_index=True, use_container_width=True)
+            
+            if perfil["texto_captura"]:
+                st.code(perfil["texto_captura"], language="text")
+            
+            col1, col2 = st.columns(2)
+            col1.download_button(
+                label="📄 Baixar perfil (JSON)",
+                data=json.dumps(perfil, ensure_ascii=False, indent=2, default=str),
+                file_name=f"{data_hoje} - Perfil de desempenho.json",
+                mime="application/json"
+            )
+            if col2.button("📝 Registrar no log de desempenho"):
+                registrar_perfil_json(perfil, arquivo=uploaded_file.name)
+                st.info(f"Perfil registrado em {ARQUIVO_LOG_DESEMPENHO}")
 else:
     st.info("👆 Por favor, carregue um arquivo Excel para começar.")
 
@@ -86,6 +261,7 @@ with st.expander("📋 Estrutura das Abas"):
     **RM**: Itens com STATUS_STYPE = 'PurRequist' 
     **PO**: Itens com STATUS_STYPE = 'POConfirm' ou 'POCreated' 
     **Stock**: Itens com Status = 'In Stock' 
+    **Alterações**: Linhas novas, alteradas e removidas desde o último processamento (apenas com a comparação ativada)
     """)
 
 # Footer com versão e criador
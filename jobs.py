@@ -0,0 +1,239 @@
+import os
+import time
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import partial
+
+from backend import processar_arquivo, calcular_hash_conteudo, VERSAO_REGRAS
+
+# Limites da fila (configuráveis por variável de ambiente)
+MAX_PROCESSOS = int(os.environ.get("PLAN_APP_MAX_PROCESSOS", str(os.cpu_count() or 1)))
+MAX_JOBS_NA_FILA = int(os.environ.get("PLAN_APP_MAX_JOBS_NA_FILA", "32"))
+
+# Resultados concluídos ficam guardados como cache (LRU + validade)
+MAX_JOBS_CONCLUIDOS = int(os.environ.get("PLAN_APP_CACHE_MAX_ENTRADAS", "16"))
+TTL_JOBS_SEGUNDOS = int(os.environ.get("PLAN_APP_CACHE_TTL_SEGUNDOS", str(12 * 60 * 60)))
+
+# Mensagem dos jobs perdidos quando um processo do pool é encerrado (falta de memória, por exemplo)
+ERRO_PROCESSO_ENCERRADO = ("O processo de processamento foi encerrado inesperadamente (possivelmente "
+                           "por falta de memória). Tente novamente ou use o processamento em blocos.")
+
+# Estados de um job
+NA_FILA = "na_fila"
+PROCESSANDO = "processando"
+CONCLUIDO = "concluido"
+ERRO = "erro"
+
+# Processos criados com spawn para não herdar as threads do servidor Streamlit
+_contexto = multiprocessing.get_context("spawn")
+
+# Estado compartilhado por todas as sessões do servidor
+_lock = threading.Lock()
+_executor = None
+_gerenciador = None
+_progresso = None
+_jobs = OrderedDict()
+_fila = deque()
+_em_execucao = 0
+
+def chave_job(conteudo, captura_perfil=None, base_incremental=None, formatacao='celulas',
+              formatos_saida=('xlsx',), somente_colunas_utilizadas=False):
+    """Identificador do job: dia, versão das regras, hash do conteúdo e opções
+
+    O mesmo arquivo enviado por várias sessões no mesmo dia é processado uma
+    única vez; o dia entra na chave porque a Overview depende da data atual.
+    """
+    dia = datetime.now().strftime("%Y%m%d")
+    chave = f"{dia}-v{VERSAO_REGRAS}-{calcular_hash_conteudo(conteudo)}"
+    if captura_perfil:
+        chave += f"-{captura_perfil}"
+    if base_incremental is not None:
+        chave += f"-incremental-{calcular_hash_conteudo(base_incremental.encode('utf-8'))[:12]}"
+    if formatacao != 'celulas':
+        chave += f"-{formatacao}"
+    if list(formatos_saida) != ['xlsx']:
+        chave += "-" + "+".join(formatos_saida)
+    if somente_colunas_utilizadas:
+        chave += "-colunas-utilizadas"
+    return chave
+
+def _executar_job(job_id, conteudo, progresso, captura_perfil=None, base_incremental=None,
+                  tamanho_bloco_leitura=None, formatacao='celulas', formatos_saida=('xlsx',),
+                  somente_colunas_utilizadas=False):
+    """Executa o processamento em um processo do pool"""
+    def informar(fracao, mensagem):
+        progresso[job_id] = (fracao, mensagem)
+
+    output, total_bi, total_rm, total_po, total_stock, perfil = processar_arquivo(
+        conteudo, progresso=informar, captura_perfil=captura_perfil,
+        base_incremental=base_incremental, tamanho_bloco_leitura=tamanho_bloco_leitura,
+        formatacao=formatacao, formato_saida=list(formatos_saida),
+        somente_colunas_utilizadas=somente_colunas_utilizadas
+    )
+    arquivos = {formato: arquivo.getvalue() for formato, arquivo in output.items()}
+    return arquivos, total_bi, total_rm, total_po, total_stock, perfil.como_dict()
+
+def _obter_executor():
+    """Cria sob demanda o pool de processos e o dicionário de progresso"""
+    global _executor, _gerenciador, _progresso
+    if _executor is None:
+        _gerenciador = _contexto.Manager()
+        _progresso = _gerenciador.dict()
+        _executor = ProcessPoolExecutor(max_workers=MAX_PROCESSOS, mp_context=_contexto)
+    return _executor
+
+def _descartar_executor(executor):
+    """Encerra um pool quebrado para que o próximo despacho crie outro (com _lock adquirido)"""
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _registrar_erro(job, mensagem):
+    """Marca o job como concluído com erro"""
+    job["concluido_em"] = time.time()
+    job["erro"] = mensagem
+    job["estado"] = ERRO
+
+def _despachar():
+    """Envia jobs da fila ao pool enquanto houver processos livres (com _lock adquirido)"""
+    global _em_execucao
+    while _fila and _em_execucao < MAX_PROCESSOS:
+        job = _jobs[_fila.popleft()]
+        conteudo = job.pop("conteudo")
+        job["estado"] = PROCESSANDO
+        job["iniciado_em"] = time.time()
+        # O pool pode ter quebrado (processo de outro job encerrado) antes de _finalizar_job
+        # descartá-lo: o job, que nem chegou a rodar, é enviado uma vez mais a um pool novo
+        for _ in range(2):
+            executor = _obter_executor()
+            try:
+                future = executor.submit(_executar_job, job["id"], conteudo, _progresso,
+                                         job["captura_perfil"], job["base_incremental"],
+                                         job["tamanho_bloco_leitura"], job["formatacao"],
+                                         job["formatos_saida"], job["somente_colunas_utilizadas"])
+                break
+            except BrokenProcessPool:
+                _descartar_executor(executor)
+        else:
+            _registrar_erro(job, ERRO_PROCESSO_ENCERRADO)
+            continue
+        _em_execucao += 1
+        future.add_done_callback(partial(_finalizar_job, job["id"], executor))
+
+def _finalizar_job(job_id, executor, future):
+    """Registra o resultado do job e libera a vaga para o próximo da fila
+
+    Se um processo do pool foi encerrado, o pool inteiro fica inutilizável:
+    ele é descartado e os próximos jobs vão para um pool novo.
+    """
+    global _em_execucao
+    with _lock:
+        _em_execucao -= 1
+        job = _jobs.get(job_id)
+        try:
+            resultado = future.result()
+        except BrokenProcessPool:
+            _descartar_executor(executor)
+            if job is not None:
+                _registrar_erro(job, ERRO_PROCESSO_ENCERRADO)
+        except Exception as e:
+            if job is not None:
+                _registrar_erro(job, str(e))
+        else:
+            if job is not None:
+                job["concluido_em"] = time.time()
+                job["resultado"] = resultado
+                job["estado"] = CONCLUIDO
+        _progresso.pop(job_id, None)
+        _despachar()
+
+def _limpar_jobs():
+    """Descarta resultados vencidos e os menos usados além do limite (com _lock adquirido)"""
+    agora = time.time()
+    finalizados = [job_id for job_id, job in _jobs.items() if job["estado"] in (CONCLUIDO, ERRO)]
+
+    for job_id in finalizados:
+        if agora - _jobs[job_id]["concluido_em"] > TTL_JOBS_SEGUNDOS:
+            del _jobs[job_id]
+
+    finalizados = [job_id for job_id in finalizados if job_id in _jobs]
+    for job_id in finalizados[:max(len(finalizados) - MAX_JOBS_CONCLUIDOS, 0)]:
+        del _jobs[job_id]
+
+def enviar_job(conteudo, captura_perfil=None, base_incremental=None, tamanho_bloco_leitura=None,
+               formatacao='celulas', formatos_saida=('xlsx',), somente_colunas_utilizadas=False):
+    """Coloca o arquivo na fila de processamento e retorna o id do job
+
+    Se o mesmo conteúdo já estiver na fila, em processamento ou concluído no
+    dia, o job existente é reaproveitado. `captura_perfil` ('cprofile' ou
+    'pyinstrument') anexa ao perfil de desempenho uma captura detalhada,
+    `base_incremental` inclui as alterações desde o último processamento da base e
+    `tamanho_bloco_leitura` processa em blocos, com memória limitada (o
+    arquivo gerado é o mesmo, por isso não faz parte do id do job).
+    `formatacao` ('celulas' ou 'condicional') define como as cores são gravadas
+    e `formatos_saida` quais dos FORMATOS_SAIDA do backend são gerados.
+    Com `somente_colunas_utilizadas`, só as colunas usadas pelas abas e pela
+    Overview são lidas e o Relatório BI sai reduzido a elas.
+    """
+    formatos_saida = tuple(formatos_saida)
+    job_id = chave_job(conteudo, captura_perfil, base_incremental, formatacao, formatos_saida,
+                       somente_colunas_utilizadas)
+
+    with _lock:
+        _limpar_jobs()
+
+        job = _jobs.get(job_id)
+        if job is not None and job["estado"] != ERRO:
+            _jobs.move_to_end(job_id)
+            return job_id
+
+        if len(_fila) >= MAX_JOBS_NA_FILA:
+            raise RuntimeError("Fila de processamento cheia. Tente novamente em alguns minutos.")
+
+        _jobs[job_id] = {
+            "id": job_id,
+            "estado": NA_FILA,
+            "enviado_em": time.time(),
+            "captura_perfil": captura_perfil,
+            "base_incremental": base_incremental,
+            "tamanho_bloco_leitura": tamanho_bloco_leitura,
+            "formatacao": formatacao,
+            "formatos_saida": formatos_saida,
+            "somente_colunas_utilizadas": somente_colunas_utilizadas,
+            "conteudo": conteudo,
+        }
+        _fila.append(job_id)
+        _despachar()
+
+    return job_id
+
+def status_job(job_id):
+    """Retorna o estado atual do job ou None se ele não existir mais
+
+    O dicionário inclui `posicao` na fila (1 = próximo), `progresso` (0 a 1) e
+    `mensagem` da etapa atual; quando concluído, `resultado` contém os bytes
+    de cada formato gerado (dict formato -> bytes), os totais de linhas e o perfil de desempenho (dict), e em caso
+    de falha `erro` traz a mensagem.
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+
+        _jobs.move_to_end(job_id)
+        status = {chave: valor for chave, valor in job.items() if chave != "conteudo"}
+
+        if job["estado"] == NA_FILA:
+            status["posicao"] = _fila.index(job_id) + 1
+            status["progresso"], status["mensagem"] = 0.0, "Aguardando na fila"
+        elif job["estado"] == PROCESSANDO:
+            status["progresso"], status["mensagem"] = _progresso.get(job_id, (0.0, "Iniciando"))
+        else:
+            status["progresso"], status["mensagem"] = 1.0, "Concluído"
+
+    return status
@@ -0,0 +1,230 @@
+"""Processamento em lote, sem interface, dos exports do BI
+
+Processa um diretório (ou glob) de arquivos .xlsx em um pool de processos e
+grava "YYYYMMDD - Rotina de planejamento.xlsx" ao lado de cada entrada (ou o
+.zip/.xlsx de dados do --formato escolhido).
+Entradas cujo conteúdo não mudou desde a última execução são puladas.
+
+Exemplos:
+    python lote.py /dados/exports
+    python lote.py "/dados/exports/*/BI*.xlsx" --processos 4
+    python lote.py /dados/exports --forcar
+    python lote.py /dados/exports --formato parquet --somente-colunas
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import backend
+
+NOME_SAIDA = " - Rotina de planejamento"
+ARQUIVO_ESTADO_PADRAO = os.path.join(backend.DIRETORIO_CACHE, 'lote_estado.json')
+
+def nome_arquivo_saida(caminho_entrada, com_nome_entrada=False, data=None, formato_saida='xlsx'):
+    """Caminho do arquivo gerado, no mesmo diretório da entrada
+
+    Com várias entradas no mesmo diretório, o nome da entrada é incluído para
+    que uma saída não sobrescreva a outra.
+    """
+    data = (data or datetime.now()).strftime("%Y%m%d")
+    if com_nome_entrada:
+        data += f" - {os.path.splitext(os.path.basename(caminho_entrada))[0]}"
+    sufixo = backend.SUFIXOS_FORMATOS_SAIDA[formato_saida]
+    return os.path.join(os.path.dirname(caminho_entrada), f"{data}{NOME_SAIDA}{sufixo}")
+
+def listar_entradas(padroes):
+    """Expande diretórios e globs em uma lista ordenada de arquivos .xlsx
+
+    Os próprios arquivos gerados e os arquivos temporários do Excel (~$) são ignorados.
+    """
+    entradas = set()
+    for padrao in padroes:
+        if os.path.isdir(padrao):
+            padrao = os.path.join(padrao, '*.xlsx')
+        for caminho in glob.glob(padrao):
+            nome = os.path.basename(caminho)
+            if nome.startswith('~$') or NOME_SAIDA in nome or not os.path.isfile(caminho):
+                continue
+            entradas.add(os.path.abspath(caminho))
+    return sorted(entradas)
+
+def carregar_estado(caminho):
+    """Lê o registro da última execução (hash e saída de cada entrada)"""
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def salvar_estado(caminho, estado):
+    """Grava o registro de forma atômica"""
+    pasta = os.path.dirname(caminho)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    temporario = f"{caminho}.tmp"
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(estado, f, indent=2, ensure_ascii=False)
+    os.replace(temporario, caminho)
+
+def inalterado(registro, hash_conteudo, formatacao='celulas', formato_saida='xlsx', somente_colunas=False):
+    """Se a entrada já foi processada com o mesmo conteúdo, as mesmas regras, formatação, formato e colunas"""
+    return (
+        registro is not None
+        and registro['hash'] == hash_conteudo
+        and registro['versao_regras'] == backend.VERSAO_REGRAS
+        and registro.get('formatacao', 'celulas') == formatacao
+        and registro.get('formato_saida', 'xlsx') == formato_saida
+        and registro.get('somente_colunas', False) == somente_colunas
+        and os.path.exists(registro['saida'])
+    )
+
+def processar_entrada(caminho, saida, motor_saida='streaming', incremental=False,
+                      tamanho_bloco_leitura=None, formatacao='celulas', formato_saida='xlsx',
+                      somente_colunas=False):
+    """Processa um arquivo em um processo do pool e grava a saída ao lado dele
+
+    Com `incremental`, a saída inclui a aba de alterações desde o último
+    processamento do mesmo caminho; com `somente_colunas`, só as colunas
+    usadas pelas abas e pela Overview são lidas.
+    """
+    inicio = time.perf_counter()
+    conteudo = backend.ler_conteudo_arquivo(caminho)
+    output, total_bi, total_rm, total_po, total_stock, _ = backend.processar_arquivo(
+        conteudo, motor_saida=motor_saida, base_incremental=caminho if incremental else None,
+        tamanho_bloco_leitura=tamanho_bloco_leitura, formatacao=formatacao, formato_saida=formato_saida,
+        somente_colunas_utilizadas=somente_colunas
+    )
+
+    with open(saida, 'wb') as f:
+        f.write(output.getvalue())
+
+    return {
+        'saida': saida,
+        'linhas': total_bi,
+        'totais': {'RM': total_rm, 'PO': total_po, 'Stock': total_stock},
+        'segundos': time.perf_counter() - inicio,
+    }
+
+def executar_lote(entradas, processos=None, motor_saida='streaming', forcar=False,
+                  arquivo_estado=ARQUIVO_ESTADO_PADRAO, incremental=False, tamanho_bloco_leitura=None,
+                  formatacao='celulas', formato_saida='xlsx', somente_colunas=False):
+    """Processa as entradas em paralelo e retorna o resumo da execução"""
+    estado = carregar_estado(arquivo_estado)
+    inicio = time.perf_counter()
+
+    por_diretorio = Counter(os.path.dirname(caminho) for caminho in entradas)
+
+    pendentes = {}
+    pulados = []
+    for caminho in entradas:
+        hash_conteudo = backend.calcular_hash_conteudo(backend.ler_conteudo_arquivo(caminho))
+        if not forcar and inalterado(estado.get(caminho), hash_conteudo, formatacao, formato_saida,
+                                     somente_colunas):
+            pulados.append(caminho)
+            print(f"= {caminho} (sem alterações)")
+        else:
+            pendentes[caminho] = hash_conteudo
+
+    processados = []
+    erros = []
+    if pendentes:
+        processos = processos or min(len(pendentes), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=processos,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futuros = {
+                executor.submit(
+                    processar_entrada, caminho,
+                    nome_arquivo_saida(caminho, por_diretorio[os.path.dirname(caminho)] > 1,
+                                       formato_saida=formato_saida),
+                    motor_saida, incremental, tamanho_bloco_leitura, formatacao, formato_saida,
+                    somente_colunas
+                ): caminho
+                for caminho in pendentes
+            }
+            for futuro in as_completed(futuros):
+                caminho = futuros[futuro]
+                try:
+                    resultado = futuro.result()
+                except Exception as e:
+                    erros.append(caminho)
+                    print(f"! {caminho}: {e}", file=sys.stderr)
+                    continue
+
+                processados.append(resultado)
+                estado[caminho] = {
+                    'hash': pendentes[caminho],
+                    'versao_regras': backend.VERSAO_REGRAS,
+                    'formatacao': formatacao,
+                    'formato_saida': formato_saida,
+                    'somente_colunas': somente_colunas,
+                    'saida': resultado['saida'],
+                    'processado_em': datetime.now().isoformat(timespec='seconds'),
+                }
+                salvar_estado(arquivo_estado, estado)
+                print(f"+ {caminho} -> {os.path.basename(resultado['saida'])} "
+                      f"({resultado['linhas']} linhas em {resultado['segundos']:.1f} s)")
+
+    segundos = time.perf_counter() - inicio
+    linhas = sum(resultado['linhas'] for resultado in processados)
+    return {
+        'processados': len(processados),
+        'pulados': len(pulados),
+        'erros': len(erros),
+        'linhas': linhas,
+        'segundos': segundos,
+        'arquivos_por_segundo': len(processados) / segundos if segundos else 0.0,
+        'linhas_por_segundo': linhas / segundos if segundos else 0.0,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Processamento em lote dos exports do BI")
+    parser.add_argument('entradas', nargs='+',
+                        help="Diretórios (todos os .xlsx) ou globs de arquivos a processar")
+    parser.add_argument('--processos', type=int,
+                        help="Número de processos em paralelo (padrão: núcleos disponíveis)")
+    parser.add_argument('--motor', default='streaming', choices=backend.MOTORES_SAIDA,
+                        help="Motor de saída usado em cada arquivo")
+    parser.add_argument('--forcar', action='store_true',
+                        help="Reprocessar também as entradas sem alterações")
+    parser.add_argument('--estado', default=ARQUIVO_ESTADO_PADRAO,
+                        help="Arquivo JSON com os hashes da última execução")
+    parser.add_argument('--alteracoes', '--incremental', dest='incremental', action='store_true',
+                        help="Incluir a aba de alterações desde o último processamento de cada entrada "
+                             "(relatório a mais; não acelera o processamento)")
+    parser.add_argument('--blocos', type=int, nargs='?', const=backend.TAMANHO_BLOCO_LEITURA,
+                        metavar='LINHAS',
+                        help="Processar em blocos de LINHAS linhas, com memória limitada "
+                             f"(padrão: {backend.TAMANHO_BLOCO_LEITURA})")
+    parser.add_argument('--formatacao', default='celulas', choices=backend.FORMATACOES,
+                        help="Cores pintadas célula a célula ou como formatação condicional do Excel")
+    parser.add_argument('--formato', default='xlsx', choices=backend.FORMATOS_SAIDA,
+                        help="Relatório formatado, .xlsx só com os dados ou .zip com um Parquet/CSV por aba")
+    parser.add_argument('--somente-colunas', action='store_true',
+                        help="Ler apenas as colunas usadas pelas abas e pela Overview (mais rápido; "
+                             "o Relatório BI sai reduzido a elas)")
+    args = parser.parse_args(argv)
+    if args.blocos is not None and (args.incremental or args.motor != 'streaming' or args.formato != 'xlsx'):
+        parser.error("--blocos não pode ser combinado com --alteracoes, outro --motor nem outro --formato")
+
+    entradas = listar_entradas(args.entradas)
+    if not entradas:
+        print("Nenhum arquivo .xlsx encontrado.", file=sys.stderr)
+        return 1
+
+    resumo = executar_lote(entradas, args.processos, args.motor, args.forcar, args.estado,
+                           args.incremental, args.blocos, args.formatacao, args.formato, args.somente_colunas)
+    print(f"\n{resumo['processados']} processados, {resumo['pulados']} sem alterações, "
+          f"{resumo['erros']} com erro em {resumo['segundos']:.1f} s "
+          f"({resumo['arquivos_por_segundo']:.2f} arquivos/s, "
+          f"{resumo['linhas_por_segundo']:.0f} linhas/s)")
+    return 1 if resumo['erros'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
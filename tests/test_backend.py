@@ -0,0 +1,373 @@
+import io
+import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter
+
+import backend
+import benchmark
+
+
+def _relatorio_xlsx(df):
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def _valores_overview(output):
+    worksheet = load_workbook(output)['Overview']
+    return [list(linha) for linha in worksheet.iter_rows(values_only=True)]
+
+
+def _estilos_celulas(output):
+    """Valor, preenchimento, fonte e formato numérico de cada célula de cada aba"""
+    workbook = load_workbook(output)
+    return {
+        aba.title: [
+            [(celula.value, celula.fill.fgColor.rgb if celula.fill.fill_type else None,
+              celula.font.color.rgb if celula.font.color is not None else None,
+              celula.font.b, celula.number_format) for celula in linha]
+            for linha in aba.iter_rows()
+        ]
+        for aba in workbook.worksheets
+    }
+
+
+def _regras_condicionais(output):
+    """Intervalo, fórmulas, prioridade e "parar se verdadeiro" das regras de cada aba"""
+    return {
+        aba.title: [
+            (str(intervalo.sqref), regra.formula, regra.priority, regra.stopIfTrue)
+            for intervalo in aba.conditional_formatting for regra in intervalo.rules
+        ]
+        for aba in load_workbook(output).worksheets
+    }
+
+
+def test_overview_com_equipment_misturando_numeros_e_textos():
+    df = pd.DataFrame({
+        'Counter': [1, 2, 3, 4],
+        'Equipment': [101, 'EQ-A', 101, 'EQ-B'],
+        'STATUS_STYPE': ['PurRequist', 'POConfirm', 'PurRequist', 'POCreated'],
+        'Status': ['In Stock', None, None, None],
+    })
+    conteudo = _relatorio_xlsx(df)
+
+    for tamanho_bloco in (None, 2):
+        output, total_bi, *_ = backend.processar_arquivo(conteudo, tamanho_bloco_leitura=tamanho_bloco)
+        linhas = _valores_overview(output)
+        inicio = linhas.index(['EQUIPMENT', 'POCONFIRM', 'POCREATED', 'PURREQUIST', 'TOTAL'])
+        assert total_bi == 4
+        assert [linha[0] for linha in linhas[inicio + 1:inicio + 5]] == [101, 'EQ-A', 'EQ-B', 'TOTAL']
+        assert linhas[inicio + 1][1:5] == [0, 0, 2, 2]
+
+
+def test_blocos_mantem_a_ordem_do_processamento_completo_com_counters_repetidos_e_vazios(monkeypatch):
+    counters = [5, None, 3, 5, 1, None, 3, 2, 5, None] * 4
+    df = pd.DataFrame({
+        'Counter': counters,
+        'MATERIAL_NO': [f'M{idx:02d}' for idx in range(len(counters))],
+        'STATUS_STYPE': ['PurRequist', 'POConfirm', 'POCreated', 'Reservation'] * 10,
+    })
+    conteudo = _relatorio_xlsx(df)
+
+    # Lotes menores que os blocos: cada sequência ocupa vários passos da intercalação
+    gravar_sequencia = backend._gravar_sequencia
+    monkeypatch.setattr(backend, '_gravar_sequencia', lambda bloco, caminho: gravar_sequencia(bloco, caminho, 3))
+
+    completo = load_workbook(backend.processar_arquivo(conteudo)[0])
+    blocos = load_workbook(backend.processar_arquivo(conteudo, tamanho_bloco_leitura=7)[0])
+    for aba in ('Relatório BI', 'RM', 'PO'):
+        assert list(blocos[aba].values) == list(completo[aba].values)
+
+
+def test_motor_openpyxl_grava_datas_no_formato_dd_mm_aaaa():
+    abertura = (pd.Timestamp.now().normalize() + pd.Timedelta(days=10)).strftime('%d/%m/%Y')
+    df = pd.DataFrame({
+        'Counter': [1, 2],
+        'MATERIAL_NO': ['M1', 'M2'],
+        'MATERIAL_DESCRIPTION': ['Peça 1', 'Peça 2'],
+        'PROCUREMENT_KEY': ['E', 'F'],
+        'STATUS_STYPE': ['PurRequist', 'POConfirm'],
+        'OPENING_DATE': [abertura, abertura],
+    })
+    conteudo = _relatorio_xlsx(df)
+
+    for motor in ('openpyxl', 'streaming'):
+        workbook = load_workbook(backend.processar_arquivo(conteudo, motor_saida=motor)[0])
+        datas = [celula for aba in ('Overview', 'Relatório BI', 'RM')
+                 for linha in workbook[aba].iter_rows() for celula in linha
+                 if isinstance(celula.value, datetime)]
+        assert len(datas) == 4
+        assert {celula.number_format for celula in datas} == {backend.FORMATO_DATA_EXCEL}
+
+
+def test_comparacao_com_o_ultimo_processamento_gera_a_aba_de_alteracoes(monkeypatch, tmp_path):
+    monkeypatch.setattr(backend, 'DIRETORIO_CACHE', str(tmp_path))
+    anterior = pd.DataFrame({
+        'Counter': [1, 2, 3],
+        'MATERIAL_NO': ['M1', 'M2', 'M3'],
+        'STATUS_STYPE': ['PurRequist', 'POConfirm', 'PurRequist'],
+    })
+    atual = pd.DataFrame({
+        'Counter': [1, 2, 4],
+        'MATERIAL_NO': ['M1', 'M2', 'M4'],
+        'STATUS_STYPE': ['PurRequist', 'POCreated', 'PurRequist'],
+    })
+
+    *_, perfil = backend.processar_arquivo(_relatorio_xlsx(anterior), base_incremental='teste')
+    assert perfil.incremental == {'sem_comparacao': True}
+
+    output, total_bi, total_rm, total_po, _, perfil = backend.processar_arquivo(
+        _relatorio_xlsx(atual), base_incremental='teste'
+    )
+    assert perfil.incremental == {'novos': 1, 'alterados': 1, 'removidos': 1, 'inalterados': 1}
+    assert (total_bi, total_rm, total_po) == (3, 2, 1)
+    alteracoes = list(load_workbook(output)[backend.ABA_ALTERACOES].values)
+    assert [(linha[0], linha[1]) for linha in alteracoes[1:]] == [('Novo', 4), ('Alterado', 2), ('Removido', 3)]
+    assert alteracoes[2][-1] == 'STATUS_STYPE: POConfirm → POCreated'
+
+
+def test_cache_de_leitura_descarta_os_arquivos_menos_usados_alem_do_limite(monkeypatch, tmp_path):
+    monkeypatch.setattr(backend, 'DIRETORIO_CACHE', str(tmp_path))
+    monkeypatch.setattr(backend, 'MAX_MB_CACHE_DISCO', 0)
+    diretorio = tmp_path / 'leitura'
+    diretorio.mkdir()
+    vencido = diretorio / 'vencido.parquet'
+    vencido.write_bytes(b'x')
+    os.utime(vencido, (0, 0))
+
+    conteudos = [_relatorio_xlsx(pd.DataFrame({'Counter': [counter]})) for counter in (1, 2)]
+    for conteudo in conteudos:
+        backend.ler_relatorio(conteudo)
+
+    # Só o último arquivo gravado fica, mesmo acima do limite
+    ultimo = backend._caminho_cache_leitura(backend.calcular_hash_conteudo(conteudos[-1]), None)
+    assert [caminho.name for caminho in diretorio.iterdir()] == [os.path.basename(ultimo)]
+
+
+def test_pico_de_memoria_do_perfil_e_o_deste_processamento():
+    # Pico anterior do processo bem acima do que um relatório pequeno consome
+    grande = np.ones(50 * 1024 * 1024)
+    del grande
+    pico_processo = backend.pico_memoria_mb()
+
+    *_, perfil = backend.processar_arquivo(_relatorio_xlsx(pd.DataFrame({'Counter': [1, 2]})))
+    dados = perfil.como_dict()
+    if dados['escopo_pico_memoria'] == 'processo':
+        pytest.skip("memória do processo indisponível neste sistema")
+    assert dados['memoria_inicial_mb'] <= dados['pico_memoria_mb'] < pico_processo - 200
+
+
+def test_alteracoes_com_formatacao_condicional_sem_processamento_anterior(monkeypatch, tmp_path):
+    monkeypatch.setattr(backend, 'DIRETORIO_CACHE', str(tmp_path))
+    conteudo = _relatorio_xlsx(pd.DataFrame({
+        'Counter': [1, 2],
+        'MATERIAL_NO': ['M1', 'M2'],
+        'STATUS_STYPE': ['PurRequist', 'POConfirm'],
+    }))
+
+    for _ in range(2):
+        output, *_, perfil = backend.processar_arquivo(conteudo, base_incremental='teste',
+                                                       formatacao='condicional')
+    assert perfil.incremental == {'novos': 0, 'alterados': 0, 'removidos': 0, 'inalterados': 2}
+    assert backend.ABA_ALTERACOES in load_workbook(output).sheetnames
+
+
+def test_motor_paralelo_gera_o_mesmo_arquivo_que_o_streaming():
+    conteudo = _relatorio_xlsx(benchmark.gerar_relatorio_sintetico(60))
+
+    for formatacao in backend.FORMATACOES:
+        streaming = backend.processar_arquivo(conteudo, formatacao=formatacao)[0]
+        paralelo = backend.processar_arquivo(conteudo, motor_saida='paralelo', formatacao=formatacao)[0]
+        assert _estilos_celulas(paralelo) == _estilos_celulas(streaming)
+        assert _regras_condicionais(paralelo) == _regras_condicionais(streaming)
+
+
+def test_motor_paralelo_escreve_em_sequencia_quando_os_estilos_divergem(monkeypatch):
+    conteudo = _relatorio_xlsx(benchmark.gerar_relatorio_sintetico(20))
+    streaming = backend.processar_arquivo(conteudo)[0]
+
+    # Abas renderizadas em threads, com o styles.xml da aba RM alterado
+    renderizar = backend._renderizar_aba_isolada
+    def renderizar_divergente(sheet_name, *args):
+        xml, estilos, segundos = renderizar(sheet_name, *args)
+        return xml, estilos + (b' ' if sheet_name == 'RM' else b''), segundos
+    monkeypatch.setattr(backend, '_renderizar_aba_isolada', renderizar_divergente)
+    monkeypatch.setattr(backend, 'ProcessPoolExecutor',
+                        lambda max_workers, mp_context: ThreadPoolExecutor(max_workers))
+
+    output, *_, perfil = backend.processar_arquivo(conteudo, motor_saida='paralelo')
+    assert 'escrita e formatação: RM' in [etapa['etapa'] for etapa in perfil.etapas]
+    assert _estilos_celulas(output) == _estilos_celulas(streaming)
+
+
+def test_formatacao_condicional_grava_as_regras_de_cor_em_ordem_de_prioridade():
+    df = benchmark.gerar_relatorio_sintetico(30)
+    output = backend.processar_arquivo(_relatorio_xlsx(df), formatacao='condicional')[0]
+    workbook = load_workbook(output)
+    regras = _regras_condicionais(output)
+
+    def coluna(aba, nome):
+        cabecalho = [celula.value for celula in workbook[aba][1]]
+        return get_column_letter(cabecalho.index(nome) + 1)
+
+    aba = workbook['Relatório BI']
+    intervalo = f"A2:{get_column_letter(aba.max_column)}{aba.max_row}"
+    assert regras['Relatório BI'] == [
+        (intervalo, [f'EXACT(${coluna("Relatório BI", "Status")}2,"In Stock")'], 1, True),
+        (intervalo, [f'EXACT(LEFT(${coluna("Relatório BI", "DEMAND")}2,1),"R")'], 2, True),
+        (intervalo, [f'EXACT(${coluna("Relatório BI", "PROCUREMENT_KEY")}2,"E")'], 3, True),
+    ]
+
+    # RM não tem DEMAND nem PROCUREMENT_KEY: só a regra de Status
+    assert [formula for _, formula, _, _ in regras['RM']] == [[f'EXACT(${coluna("RM", "Status")}2,"In Stock")']]
+    assert regras['Overview'] == []
+
+    # Nenhuma célula de dados é pintada diretamente
+    assert {celula.fill.fill_type for linha in aba.iter_rows(min_row=2) for celula in linha} == {None}
+
+
+def test_motor_streaming_grava_cabecalho_cores_larguras_filtro_e_congelamento():
+    df = pd.DataFrame({
+        'Counter': [1, 2, 3, 4],
+        'Status': ['In Stock', 'Open', 'Open', 'Open'],
+        'DEMAND': ['R100', 'R200', 'S300', 'P400'],
+        'PROCUREMENT_KEY': ['E', 'E', 'E', 'F'],
+        'MATERIAL_DESCRIPTION': ['X' * 60, 'curta', None, 'média'],
+    })
+    aba = load_workbook(backend.processar_arquivo(_relatorio_xlsx(df))[0])['Relatório BI']
+
+    cabecalho = aba[1]
+    assert [celula.value for celula in cabecalho] == list(df.columns)
+    assert {(celula.fill.fgColor.rgb, celula.font.b, celula.font.name) for celula in cabecalho} == \
+        {('008F8D8D', True, 'Aptos Narrow')}
+
+    # Prioridade: In Stock, DEMAND com R, PROCUREMENT_KEY = E; a última linha fica sem cor
+    cores = [
+        {(celula.fill.fgColor.rgb if celula.fill.fill_type else None, celula.font.color.rgb
+          if celula.font.color is not None else None, celula.font.name) for celula in linha}
+        for linha in aba.iter_rows(min_row=2)
+    ]
+    assert cores == [
+        {('0038F58A', None, 'Aptos Narrow')},
+        {('00061569', '00FFFFFF', 'Aptos Narrow')},
+        {('004AAFBD', None, 'Aptos Narrow')},
+        {(None, None, 'Aptos Narrow')},
+    ]
+
+    larguras = [aba.column_dimensions[letra].width for letra in 'ABCDE']
+    assert larguras == [len('Counter') + 2, len('In Stock') + 2, len('DEMAND') + 2,
+                        len('PROCUREMENT_KEY') + 2, backend.LARGURA_MAXIMA_COLUNA]
+    assert aba.freeze_panes == 'A2'
+    assert aba.auto_filter.ref == 'A1:E5'
+
+
+def _sem_dimensao(conteudo):
+    """Copia o .xlsx removendo a tag <dimension> das abas, como fazem alguns exportadores"""
+    origem = zipfile.ZipFile(io.BytesIO(conteudo))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as destino:
+        for item in origem.infolist():
+            dados = origem.read(item.filename)
+            if item.filename.startswith('xl/worksheets/'):
+                dados = re.sub(rb'<dimension [^>]*/>', b'', dados)
+            destino.writestr(item, dados)
+    return buffer.getvalue()
+
+
+def test_esquema_le_o_cabecalho_e_as_linhas_com_e_sem_dimensao():
+    conteudo = _relatorio_xlsx(pd.DataFrame({'Counter': range(5), 'STATUS_STYPE': 'PurRequist'}))
+
+    assert backend.ler_esquema_relatorio(conteudo) == \
+        {'colunas': ['Counter', 'STATUS_STYPE'], 'linhas': 5, 'linhas_estimadas': False}
+    assert backend.ler_esquema_relatorio(_sem_dimensao(conteudo)) == \
+        {'colunas': ['Counter', 'STATUS_STYPE'], 'linhas': 5, 'linhas_estimadas': False}
+
+    # Sem a dimensão e maior que a amostra: linhas estimadas pelo tamanho do XML
+    grande = _sem_dimensao(_relatorio_xlsx(pd.DataFrame({'Counter': range(20_000), 'Status': 'In Stock'})))
+    esquema = backend.ler_esquema_relatorio(grande)
+    assert esquema['colunas'] == ['Counter', 'Status'] and esquema['linhas_estimadas']
+    assert 18_000 < esquema['linhas'] < 22_000
+
+
+def test_validar_esquema_aponta_erros_e_repete_os_avisos_dos_esquemas_conhecidos(tmp_path):
+    conhecidos = str(tmp_path / 'esquemas.json')
+    incompleto = backend.validar_esquema(['Counter', 'MATERIAL_NO'], conhecidos)
+    assert not incompleto['valido']
+    assert any('coluna de filtro STATUS_STYPE' in erro for erro in incompleto['erros'])
+
+    colunas = list(dict.fromkeys(backend.COLUNAS_UTILIZADAS + backend.COLUNAS_RM))
+    colunas.remove('VENDOR_NAME')
+    primeiro = backend.validar_esquema(colunas, conhecidos)
+    assert primeiro['valido'] and not primeiro['conhecido'] and not primeiro['erros']
+    assert any('VENDOR_NAME' in aviso for aviso in primeiro['avisos'])
+
+    segundo = backend.validar_esquema(colunas, conhecidos)
+    assert segundo['conhecido'] and segundo['avisos'] == primeiro['avisos']
+    assert not backend.validar_esquema(['Counter', 'MATERIAL_NO'], conhecidos)['conhecido']
+
+
+def test_formatos_de_dados_gerados_do_mesmo_processamento():
+    abertura = pd.Timestamp.now().normalize() + pd.Timedelta(days=10)
+    df = pd.DataFrame({
+        'Counter': [2, 1],
+        'Status': ['In Stock', 'Open'],
+        'STATUS_STYPE': ['PurRequist', 'POConfirm'],
+        'OPENING_DATE': [abertura.strftime('%d/%m/%Y')] * 2,
+    })
+    saidas, total_bi, total_rm, *_ = backend.processar_arquivo(
+        _relatorio_xlsx(df), formato_saida=['xlsx_simples', 'parquet', 'csv']
+    )
+    assert set(saidas) == {'xlsx_simples', 'parquet', 'csv'} and (total_bi, total_rm) == (2, 1)
+    abas = ['Overview', 'Relatório BI', 'RM', 'PO', 'Stock']
+
+    # .xlsx de dados: sem estilos, apenas as datas com formato DD/MM/YYYY
+    workbook = load_workbook(saidas['xlsx_simples'])
+    assert workbook.sheetnames == abas
+    relatorio = workbook['Relatório BI']
+    assert [celula.value for celula in relatorio[1]] == list(df.columns)
+    assert [celula.value for celula in relatorio['A'][1:]] == [1, 2]
+    assert {celula.number_format for celula in relatorio['D'][1:]} == {backend.FORMATO_DATA_EXCEL}
+    assert {celula.fill.fill_type for linha in relatorio.iter_rows() for celula in linha} == {None}
+    assert relatorio.freeze_panes is None and relatorio.auto_filter.ref is None
+
+    with zipfile.ZipFile(saidas['parquet']) as pacote:
+        assert pacote.namelist() == [f'{aba}.parquet' for aba in abas]
+        rm = pd.read_parquet(io.BytesIO(pacote.read('RM.parquet')))
+        assert rm['Status'].tolist() == ['In Stock'] and rm['OPENING_DATE'].tolist() == [abertura]
+
+    with zipfile.ZipFile(saidas['csv']) as pacote:
+        assert pacote.namelist() == [f'{aba}.csv' for aba in abas]
+        relatorio_csv = pd.read_csv(io.BytesIO(pacote.read('Relatório BI.csv')))
+        assert relatorio_csv.columns.tolist() == list(df.columns) and relatorio_csv['Counter'].tolist() == [1, 2]
+        # Overview sem cabeçalho: a primeira linha já é o primeiro título, como no .xlsx
+        primeira_linha = pacote.read('Overview.csv').decode('utf-8').splitlines()[0]
+        assert primeira_linha.split(',')[0] == _valores_overview(saidas['xlsx_simples'])[0][0]
+
+
+def test_somente_colunas_utilizadas_le_so_as_colunas_das_abas_e_da_overview(monkeypatch, tmp_path):
+    monkeypatch.setattr(backend, 'DIRETORIO_CACHE', str(tmp_path))
+    df = pd.DataFrame({'Counter': [1], 'STATUS_STYPE': ['PurRequist'], 'Sem uso': ['x']})
+    output = backend.processar_arquivo(_relatorio_xlsx(df), somente_colunas_utilizadas=True)[0]
+    assert [celula.value for celula in load_workbook(output)['Relatório BI'][1]] == ['Counter', 'STATUS_STYPE']
+
+    # Cada motor de leitura tem a sua entrada no cache
+    assert backend._caminho_cache_leitura('hash', None, 'calamine') != \
+        backend._caminho_cache_leitura('hash', None, 'openpyxl')
+
+
+def test_formato_de_data_inferido_nao_passa_de_um_arquivo_para_outro():
+    # Um arquivo com mês antes do dia não muda a leitura do próximo
+    americano = backend.preparar_relatorio(pd.DataFrame({'OPENING_DATE': ['04/25/2024', '03/04/2024']}))
+    assert americano['OPENING_DATE'].tolist() == [pd.Timestamp(2024, 4, 25), pd.Timestamp(2024, 3, 4)]
+
+    brasileiro = backend.preparar_relatorio(pd.DataFrame({'OPENING_DATE': ['03/04/2024', '05/06/2024']}))
+    assert brasileiro['OPENING_DATE'].tolist() == [pd.Timestamp(2024, 4, 3), pd.Timestamp(2024, 6, 5)]
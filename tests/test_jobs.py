@@ -0,0 +1,109 @@
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import jobs
+
+
+class _PoolFalso:
+    """Pool que guarda os futuros enviados em vez de executá-los"""
+
+    def __init__(self, quebrado=False):
+        self.quebrado = quebrado
+        self.futuros = []
+        self.encerrado = False
+
+    def submit(self, funcao, job_id, *args):
+        if self.quebrado:
+            raise BrokenProcessPool("processo encerrado")
+        futuro = Future()
+        self.futuros.append(futuro)
+        return futuro
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.encerrado = True
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    """Estado dos jobs zerado e uma fila de pools falsos entregue por _obter_executor"""
+    criados = []
+    proximos = []
+
+    def obter_executor():
+        pool = proximos.pop(0) if proximos else _PoolFalso()
+        criados.append(pool)
+        return pool
+
+    monkeypatch.setattr(jobs, '_jobs', OrderedDict())
+    monkeypatch.setattr(jobs, '_fila', deque())
+    monkeypatch.setattr(jobs, '_em_execucao', 0)
+    monkeypatch.setattr(jobs, '_progresso', {})
+    monkeypatch.setattr(jobs, '_obter_executor', obter_executor)
+    monkeypatch.setattr(jobs, 'MAX_PROCESSOS', 1)
+    return criados, proximos
+
+
+def test_fila_informa_a_posicao_e_despacha_o_proximo_ao_concluir(pools):
+    criados, _ = pools
+    ids = [jobs.enviar_job(conteudo) for conteudo in (b'a', b'b', b'c')]
+
+    assert jobs.status_job(ids[0])['estado'] == jobs.PROCESSANDO
+    assert [jobs.status_job(job_id)['posicao'] for job_id in ids[1:]] == [1, 2]
+
+    criados[0].futuros[0].set_result(({'xlsx': b''}, 0, 0, 0, 0, {}))
+    assert jobs.status_job(ids[0])['estado'] == jobs.CONCLUIDO
+    assert jobs.status_job(ids[1])['estado'] == jobs.PROCESSANDO
+    assert jobs.status_job(ids[2])['posicao'] == 1
+
+
+def test_mesmo_arquivo_reaproveita_o_job_e_so_e_reenviado_apos_erro(pools):
+    criados, _ = pools
+    job_id = jobs.enviar_job(b'a')
+    assert jobs.enviar_job(b'a') == job_id
+    assert sum(len(pool.futuros) for pool in criados) == 1
+
+    criados[0].futuros[0].set_exception(ValueError("arquivo inválido"))
+    assert jobs.status_job(job_id)['erro'] == "arquivo inválido"
+    assert jobs.enviar_job(b'a') == job_id
+    assert jobs.status_job(job_id)['estado'] == jobs.PROCESSANDO
+
+
+def test_pool_quebrado_antes_do_envio_e_trocado_sem_falhar_o_job(pools):
+    criados, proximos = pools
+    proximos.append(_PoolFalso(quebrado=True))
+    job_id = jobs.enviar_job(b'a')
+
+    assert jobs.status_job(job_id)['estado'] == jobs.PROCESSANDO
+    assert criados[0].encerrado and not criados[1].encerrado
+    assert len(criados[1].futuros) == 1
+
+
+def test_job_falha_quando_o_pool_novo_tambem_esta_quebrado(pools):
+    _, proximos = pools
+    proximos.extend([_PoolFalso(quebrado=True), _PoolFalso(quebrado=True)])
+    job_id = jobs.enviar_job(b'a')
+
+    status = jobs.status_job(job_id)
+    assert status['estado'] == jobs.ERRO
+    assert status['erro'] == jobs.ERRO_PROCESSO_ENCERRADO
+    assert jobs._em_execucao == 0
+
+
+def test_limpeza_descarta_os_vencidos_e_os_menos_usados_alem_do_limite(pools, monkeypatch):
+    monkeypatch.setattr(jobs, 'MAX_JOBS_CONCLUIDOS', 2)
+    monkeypatch.setattr(jobs, 'TTL_JOBS_SEGUNDOS', 60)
+    agora = time.time()
+    for job_id, concluido_em in [('vencido', agora - 120), ('a', agora), ('b', agora), ('c', agora)]:
+        jobs._jobs[job_id] = {'id': job_id, 'estado': jobs.CONCLUIDO, 'concluido_em': concluido_em}
+    jobs._jobs['na_fila'] = {'id': 'na_fila', 'estado': jobs.NA_FILA}
+    jobs._fila.append('na_fila')
+
+    # Consultar o job 'a' o torna o mais recente
+    jobs.status_job('a')
+    jobs._limpar_jobs()
+
+    assert list(jobs._jobs) == ['c', 'na_fila', 'a']
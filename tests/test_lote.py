@@ -0,0 +1,49 @@
+import os
+
+import pandas as pd
+import pytest
+
+import lote
+
+
+def _entrada(caminho, counters):
+    pd.DataFrame({'Counter': counters, 'STATUS_STYPE': 'PurRequist'}).to_excel(caminho, index=False)
+    return str(caminho)
+
+
+def test_segunda_execucao_pula_as_entradas_sem_alteracoes(tmp_path):
+    entradas = [_entrada(tmp_path / 'a.xlsx', [1, 2]), _entrada(tmp_path / 'b.xlsx', [3])]
+    estado = str(tmp_path / 'estado.json')
+
+    primeira = lote.executar_lote(entradas, processos=2, arquivo_estado=estado)
+    assert (primeira['processados'], primeira['pulados'], primeira['erros']) == (2, 0, 0)
+
+    # Duas entradas no mesmo diretório: o nome de cada uma entra no nome da saída
+    saidas = sorted(nome for nome in os.listdir(tmp_path) if lote.NOME_SAIDA in nome)
+    assert [nome.split(' - ')[1] for nome in saidas] == ['a', 'b']
+    assert lote.listar_entradas([str(tmp_path)]) == entradas
+
+    segunda = lote.executar_lote(entradas, processos=2, arquivo_estado=estado)
+    assert (segunda['processados'], segunda['pulados']) == (0, 2)
+
+    # Conteúdo alterado reprocessa só a entrada; outra formatação reprocessa todas
+    _entrada(tmp_path / 'a.xlsx', [1, 2, 4])
+    terceira = lote.executar_lote(entradas, processos=2, arquivo_estado=estado)
+    assert (terceira['processados'], terceira['pulados']) == (1, 1)
+    quarta = lote.executar_lote(entradas, processos=2, arquivo_estado=estado, formatacao='condicional')
+    assert (quarta['processados'], quarta['pulados']) == (2, 0)
+
+
+def test_nome_da_saida_so_inclui_a_entrada_quando_ha_varias_no_diretorio(tmp_path):
+    caminho = str(tmp_path / 'BI.xlsx')
+    data = pd.Timestamp(2024, 5, 1)
+    assert lote.nome_arquivo_saida(caminho, data=data) == \
+        str(tmp_path / '20240501 - Rotina de planejamento.xlsx')
+    assert lote.nome_arquivo_saida(caminho, True, data, 'csv') == \
+        str(tmp_path / '20240501 - BI - Rotina de planejamento (csv).zip')
+
+
+@pytest.mark.parametrize('opcao', [['--alteracoes'], ['--motor', 'openpyxl'], ['--formato', 'csv']])
+def test_blocos_recusa_opcoes_incompativeis(opcao, tmp_path):
+    with pytest.raises(SystemExit):
+        lote.main([str(tmp_path), '--blocos', *opcao])